@@ -1,54 +1,148 @@
 from flask import Flask
-from pymongo import MongoClient
 import os
+import click
 from dotenv import load_dotenv
+from serialization import FastJSONProvider
+from connections import LazyDatabase, REPLICA_READ, init_causal_reads
+from indexes import start_index_build
+from routes.expiry import start_sweeper
+from metrics import init_metrics
 
 load_dotenv()
 
 MONGO_URI = os.getenv("MONGO_URI")
 DB_NAME = os.getenv("DB_NAME", "ticket_marketplace")
 
-app = Flask(__name__)
-app.secret_key = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
-
-client = MongoClient(MONGO_URI)
-db = client[DB_NAME]
-
-# Create unique index for users email
-try:
-    db.users.create_index([("email", 1)], unique=True)
-except Exception:
-    pass
-
-# Import and register blueprints
-from routes.auth import init_auth
-from routes.users import init_users
-from routes.events import init_events
-from routes.tickets import init_tickets
-from routes.orders import init_orders
-from routes.cart import init_cart
-from routes.analytics import init_analytics
-from routes.debug import init_debug
-
-# Initialize blueprints with db connection
-auth_bp = init_auth(app, db)
-users_bp = init_users(app, db)
-events_bp = init_events(app, db)
-tickets_bp = init_tickets(db)
-orders_bp, create_order_internal = init_orders(db)
-cart_bp = init_cart(app, db, create_order_internal)
-analytics_bp = init_analytics(db)
-debug_bp = init_debug()
-
-# Register blueprints
-app.register_blueprint(auth_bp)
-app.register_blueprint(users_bp)
-app.register_blueprint(events_bp)
-app.register_blueprint(tickets_bp)
-app.register_blueprint(orders_bp)
-app.register_blueprint(cart_bp)
-app.register_blueprint(analytics_bp)
-app.register_blueprint(debug_bp)
+def create_app():
+    """Application factory.
+
+    Cheap and safe to call before a fork: Mongo and Redis clients are
+    created lazily per worker process (connections.py, RedisCache) and the
+    index build runs in the background after a worker's first request, in
+    one worker at a time (INDEX_BUILD_ON_START=0 disables it; run
+    `flask ensure-indexes` at deploy time instead). The pending-order
+    sweeper starts the same way (ORDER_SWEEPER=0 disables it; use
+    `flask expire-orders` from cron instead).
+    """
+    app = Flask(__name__)
+    app.secret_key = os.getenv("SECRET_KEY", "your-secret-key-change-in-production")
+    app.json = FastJSONProvider(app)
+    init_metrics(app)
+    init_causal_reads(app)
+
+    # Primary for writes and the order/cart/checkout paths; catalog browsing
+    # and analytics read from secondaries (see connections.py)
+    db = LazyDatabase(DB_NAME)
+    read_db = LazyDatabase(DB_NAME, read_preference=REPLICA_READ)
+    app.extensions["db"] = db
+
+    # Import and register blueprints
+    from routes.auth import init_auth
+    from routes.users import init_users
+    from routes.events import init_events
+    from routes.tickets import init_tickets
+    from routes.orders import init_orders
+    from routes.cart import init_cart
+    from routes.analytics import init_analytics
+    from routes.debug import init_debug
+    from routes.live import init_live
+
+    # Initialize blueprints with db connection
+    auth_bp = init_auth(app, db)
+    users_bp = init_users(app, db)
+    events_bp = init_events(app, db, read_db)
+    tickets_bp = init_tickets(db, read_db)
+    orders_bp, create_order_internal = init_orders(db)
+    cart_bp = init_cart(app, db, create_order_internal)
+    analytics_bp = init_analytics(read_db)
+    debug_bp = init_debug()
+    live_bp = init_live(db)  # primary: a change must not be followed by a stale read
+
+    # Register blueprints
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(users_bp)
+    app.register_blueprint(events_bp)
+    app.register_blueprint(tickets_bp)
+    app.register_blueprint(orders_bp)
+    app.register_blueprint(cart_bp)
+    app.register_blueprint(analytics_bp)
+    app.register_blueprint(debug_bp)
+    app.register_blueprint(live_bp)
+
+    if os.getenv("INDEX_BUILD_ON_START", "1") == "1":
+        started = set()
+
+        @app.before_request
+        def _bootstrap_indexes():
+            # Create declared indexes (see indexes.py) without blocking the request
+            if os.getpid() not in started:
+                started.add(os.getpid())
+                start_index_build(db, once_per=600)
+
+    if os.getenv("ORDER_SWEEPER", "1") == "1":
+        sweeping = set()
+
+        @app.before_request
+        def _start_order_sweeper():
+            # Cancel expired pending orders in the background (routes/expiry.py)
+            if os.getpid() not in sweeping:
+                sweeping.add(os.getpid())
+                start_sweeper(db)
+
+    return app
+
+app = create_app()
+db = app.extensions["db"]
+
+@app.cli.command("rebuild-ticket-status")
+def rebuild_ticket_status_cmd():
+    """Backfill ticket status fields from existing orders"""
+    from routes.inventory import rebuild_ticket_status, reset_ga_pools
+    updated = rebuild_ticket_status(db)
+    print(f"Ticket status rebuilt ({updated} tickets marked reserved/sold)")
+    print(f"GA pools reset: {reset_ga_pools()}")
+
+@app.cli.command("rebuild-event-stats")
+def rebuild_event_stats_cmd():
+    """Recompute the event_stats analytics rollup from orders"""
+    from routes.stats import rebuild_event_stats
+    print(f"Event stats rebuilt for {rebuild_event_stats(db)} events")
+
+@app.cli.command("rebuild-search-tokens")
+def rebuild_search_tokens_cmd():
+    """Backfill search tokens on events and users"""
+    from routes.search import rebuild_search_fields, EVENT_SEARCH_FIELDS, USER_SEARCH_FIELDS
+    print(f"Events updated: {rebuild_search_fields(db.events, EVENT_SEARCH_FIELDS)}")
+    print(f"Users updated: {rebuild_search_fields(db.users, USER_SEARCH_FIELDS)}")
+
+@app.cli.command("expire-orders")
+@click.option("--batch-size", default=500, show_default=True)
+@click.option("--backfill", is_flag=True, help="First set expiresAt on pending orders that have none")
+def expire_orders_cmd(batch_size, backfill):
+    """Cancel expired pending orders and release their tickets"""
+    from routes.expiry import expire_pending_orders, backfill_expiry
+    if backfill:
+        print(f"expiresAt set on {backfill_expiry(db)} pending orders")
+    print(f"Expired {expire_pending_orders(db, batch_size=batch_size)} pending orders")
+
+@app.cli.command("ensure-indexes")
+def ensure_indexes_cmd():
+    """Create all declared MongoDB indexes"""
+    from indexes import ensure_indexes
+    for coll, names in ensure_indexes(db).items():
+        print(f"{coll}: {', '.join(names)}")
+
+@app.cli.command("check-indexes")
+def check_indexes_cmd():
+    """Explain each route's canonical queries, fail on COLLSCAN"""
+    from indexes import check_indexes, canonical_queries
+    failures = check_indexes(db)
+    for coll, name, stages in failures:
+        print(f"COLLSCAN  {coll}: {name}  ({' > '.join(stages)})")
+    total = len(canonical_queries())
+    print(f"{total - len(failures)}/{total} canonical queries use an index")
+    if failures:
+        raise SystemExit(1)
 
 if __name__ == "__main__":
     app.run(debug=True, use_reloader=False)
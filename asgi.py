@@ -0,0 +1,227 @@
+"""Async serving mode (optional).
+
+    pip install quart a2wsgi hypercorn
+    hypercorn asgi:app --workers 2
+
+The hot catalog reads are served by Quart views running on asyncio, with
+pymongo's AsyncMongoClient and redis.asyncio; independent I/O inside a
+request is fanned out with asyncio.gather (GET /tickets reads the ticket
+documents and the Redis cart holds at the same time). Idle or slow client
+connections only cost a coroutine, not a thread - which matters most for
+the live availability stream (SSE), served here as an async view on the
+same AvailabilityHub as the Flask route.
+
+Native async views (this module): GET /health, GET /tickets,
+GET /events/<id> and the availability stream. That is all - the write hot
+paths are NOT converted: cart (POST /cart/items, checkout), order creation
+and payment still run the Flask views. Their inventory logic (Lua take
+scripts, claims, order transactions in routes/inventory.py and
+routes/orders.py) is synchronous, and an async copy would have to be kept in
+step with it.
+
+Every other route, those included, is handed to the regular Flask app from
+app.py through a2wsgi's WSGIMiddleware, which runs each request on a thread
+pool of ASYNC_WSGI_THREADS (default 32) threads per process, so both modes
+share one set of routes, sessions and behaviour. A slow cart or checkout
+request therefore still holds one of those threads; size the pool (and the
+Mongo/Redis connection pools) for the expected concurrent checkouts. A route
+moves to the async side by adding an async view here built from the same
+helpers as its init_* version, with the same rate limit, read routing and
+metrics.
+"""
+import asyncio
+import os
+import queue
+import time
+from contextlib import asynccontextmanager
+from functools import wraps
+import redis.asyncio as aioredis
+from pymongo import AsyncMongoClient
+from werkzeug.exceptions import NotFound, MethodNotAllowed
+
+try:
+    from quart import Quart, Response, request, jsonify, session, make_response
+    from a2wsgi import WSGIMiddleware
+except ImportError as e:
+    raise ImportError("async mode needs the optional packages: pip install quart a2wsgi") from e
+
+from app import app as flask_app, MONGO_URI, DB_NAME
+from connections import REPLICA_READ, REPLICA_READS, MAX_STALENESS, _load_token
+from metrics import MongoMetrics, init_async_metrics, instrument_redis
+from redis_cache import RedisCache, rate_limiter
+from routes.utils import oid, serialize, rate_limit_key, _limit_spec
+from routes.tickets import ticket_query, ticket_listing
+from routes.inventory import held_ticket_ids_async
+from routes.live import LoopViewer, KEEPALIVE, _RESET, _sse
+
+MONGO_MAX_POOL = int(os.getenv("ASYNC_MONGO_MAX_POOL", 100))
+WSGI_THREADS = int(os.getenv("ASYNC_WSGI_THREADS", 32))
+
+def async_rate_limit(name, default, per="user"):
+    """routes.utils.rate_limit for async views: same buckets and headers.
+    The limiter is synchronous, so the hit runs in a thread."""
+    def decorator(f):
+        @wraps(f)
+        async def decorated_function(*args, **kwargs):
+            spec = _limit_spec(name, default)
+            if not spec:
+                return await f(*args, **kwargs)
+            limit, window = spec
+            identifier = rate_limit_key(name, per, session.get('user_id'), request.remote_addr)
+            result = await asyncio.to_thread(rate_limiter.hit, identifier, limit, window)
+            if not result.allowed:
+                resp = jsonify({"error": "rate limit exceeded", "retryAfter": result.headers()["Retry-After"]})
+                resp.status_code = 429
+            else:
+                resp = await make_response(await f(*args, **kwargs))
+            resp.headers.update(result.headers())
+            return resp
+        return decorated_function
+    return decorator
+
+def create_async_app():
+    """Quart app with the async versions of the hot read routes"""
+    aapp = Quart(__name__, static_folder=None)
+    aapp.secret_key = flask_app.secret_key
+    init_async_metrics(aapp)
+    live_hub = flask_app.blueprints["live"].hub  # one hub per process for both modes
+    state = {}
+
+    @aapp.before_serving
+    async def connect():
+        # Clients are bound to the serving event loop, so they are created here
+        state["mongo"] = AsyncMongoClient(MONGO_URI, maxPoolSize=MONGO_MAX_POOL,
+                                          event_listeners=[MongoMetrics()])
+        state["db"] = state["mongo"][DB_NAME]
+        # catalog reads go to secondaries, as in the Flask app (connections.py)
+        state["read_db"] = state["mongo"].get_database(DB_NAME, read_preference=REPLICA_READ)
+        state["redis"] = instrument_redis(RedisCache._connect(decode_responses=True, client_module=aioredis))
+        try:
+            await state["redis"].ping()
+        except Exception as e:
+            print(f"Async Redis connection error: {e}")
+            state["redis"] = None
+
+    @aapp.after_serving
+    async def disconnect():
+        await state["mongo"].close()
+        if state["redis"]:
+            await state["redis"].aclose()
+
+    @asynccontextmanager
+    async def causal_session():
+        """Causally consistent session advanced to the user's last write
+        (the token the Flask app keeps in the session), or None"""
+        token = session.get("causal") if REPLICA_READS else None
+        if not token or time.time() - token.get("at", 0) > MAX_STALENESS:
+            yield None
+            return
+        op_time, cluster_time = _load_token(token)
+        async with state["mongo"].start_session(causal_consistency=True) as s:
+            if cluster_time:
+                s.advance_cluster_time(cluster_time)
+            s.advance_operation_time(op_time)
+            yield s
+
+    @aapp.get("/health")
+    async def health():
+        return {"status": "ok", "mode": "async"}
+
+    # Endpoint names match the Flask views, so both modes share metric labels
+    @aapp.get("/tickets", endpoint="tickets.list_tickets")
+    @async_rate_limit("tickets", "120/60", per="ip")
+    async def list_tickets():
+        event_id = request.args.get("eventId")
+        if not event_id:
+            return jsonify({"error": "eventId is required"}), 400
+        _event = oid(event_id)
+        if not _event:
+            return jsonify({"error": "invalid eventId"}), 400
+
+        q, error = ticket_query(request.args, _event)
+        if error:
+            return jsonify({"error": error}), 400
+
+        # Holds (Redis) and tickets (Mongo) do not depend on each other
+        async with causal_session() as s:
+            tickets, reserved_ticket_ids = await asyncio.gather(
+                state["read_db"].tickets.find(q, session=s).to_list(None),
+                held_ticket_ids_async(state["redis"], _event),
+            )
+        data = ticket_listing(tickets, reserved_ticket_ids)
+        return jsonify({"data": data, "meta": {"total": len(data)}})
+
+    @aapp.get("/events/<event_id>", endpoint="events.get_event")
+    async def get_event(event_id):
+        _id = oid(event_id)
+        if not _id:
+            return jsonify({"error": "invalid event ID"}), 400
+        async with causal_session() as s:
+            event = await state["read_db"].events.find_one({"_id": _id}, session=s)
+        if not event:
+            return jsonify({"error": "event not found"}), 404
+        return jsonify(serialize(event))
+
+    @aapp.get("/events/<event_id>/availability/stream", endpoint="live.availability_stream")
+    @async_rate_limit("availability_stream", "60/60")
+    async def availability_stream(event_id):
+        """routes/live.py stream as a coroutine: the viewer waits on the hub
+        without holding a thread"""
+        _event = oid(event_id)
+        if not _event:
+            return jsonify({"error": "invalid event id"}), 400
+        viewer = LoopViewer(asyncio.get_running_loop())
+
+        async def stream():
+            try:
+                # the first viewer of an event computes the rows (sync Mongo)
+                _, snapshot = await asyncio.to_thread(live_hub.subscribe, _event, viewer)
+                yield "retry: 3000\n\n"
+                yield _sse("snapshot", snapshot, snapshot["v"])
+                while True:
+                    try:
+                        delta = await viewer.get_async(KEEPALIVE)
+                    except queue.Empty:
+                        yield ": keepalive\n\n"
+                        continue
+                    if delta is _RESET:
+                        return
+                    if delta["v"] <= snapshot["v"]:
+                        continue  # already part of the snapshot
+                    yield _sse("delta", delta, delta["v"])
+            finally:
+                # also on client disconnect (the task is cancelled)
+                live_hub.unsubscribe(_event, viewer)
+
+        resp = Response(stream(), mimetype="text/event-stream", headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",
+        })
+        resp.timeout = None  # RESPONSE_TIMEOUT would cut the stream after 60 s
+        return resp
+
+    return aapp
+
+class Dispatcher:
+    """ASGI entry point: routes known to the async app go there, the rest
+    to the WSGI Flask app on a thread pool"""
+
+    def __init__(self, async_app, wsgi_app, threads=WSGI_THREADS):
+        self.async_app = async_app
+        self.wsgi_app = WSGIMiddleware(wsgi_app, workers=threads)
+        self._routes = async_app.url_map.bind("")
+
+    def _is_async(self, scope):
+        try:
+            self._routes.match(scope["path"], method=scope["method"])
+            return True
+        except (NotFound, MethodNotAllowed):
+            return False
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "http" and not self._is_async(scope):
+            return await self.wsgi_app(scope, receive, send)
+        return await self.async_app(scope, receive, send)
+
+async_app = create_async_app()
+app = Dispatcher(async_app, flask_app)
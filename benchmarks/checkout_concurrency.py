@@ -0,0 +1,118 @@
+"""Concurrent checkout benchmark.
+
+Fires many concurrent order creations at one event, with overlapping seat
+choices, and reports throughput plus the number of oversold tickets (tickets
+that ended up in more than one paid/pending order - must be 0).
+
+    python benchmarks/checkout_concurrency.py --requests 500 --concurrency 64
+
+Uses MONGO_URI and a separate database (BENCH_DB_NAME, default
+ticket_marketplace_bench) which is dropped afterwards unless --keep is given.
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson.int64 import Int64
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+load_dotenv()
+
+def seed(db, seats, users):
+    event_id = db.events.insert_one({
+        "title": "Checkout benchmark",
+        "eventDate": datetime.now(timezone.utc),
+    }).inserted_id
+    ticket_ids = db.tickets.insert_many([
+        {"eventId": event_id, "type": "seat", "seat": f"S{i}", "price": Int64(3500), "status": "available"}
+        for i in range(seats)
+    ]).inserted_ids
+    user_ids = db.users.insert_many([
+        {"name": f"bench{i}", "email": f"bench{i}@example.com"} for i in range(users)
+    ]).inserted_ids
+    return event_id, ticket_ids, user_ids
+
+def oversold(db, event_id):
+    pipeline = [
+        {"$match": {"status": {"$in": ["paid", "pending"]}}},
+        {"$unwind": "$items"},
+        {"$lookup": {"from": "tickets", "localField": "items.ticketId", "foreignField": "_id", "as": "t"}},
+        {"$match": {"t.eventId": event_id}},
+        {"$group": {"_id": "$items.ticketId", "orders": {"$sum": 1}}},
+        {"$match": {"orders": {"$gt": 1}}},
+        {"$count": "n"},
+    ]
+    res = list(db.orders.aggregate(pipeline))
+    return res[0]["n"] if res else 0
+
+def run(db, create_order, args):
+    event_id, ticket_ids, user_ids = seed(db, args.seats, args.users)
+    rnd = random.Random(args.seed)
+    # Everyone goes for the same small block of seats to force contention
+    hot = ticket_ids[:max(args.per_order, int(len(ticket_ids) * args.hot_fraction))]
+    jobs = [(rnd.choice(user_ids), rnd.sample(hot, args.per_order)) for _ in range(args.requests)]
+
+    latencies = []
+    def checkout(job):
+        user_id, tids = job
+        t0 = time.perf_counter()
+        ok, result = create_order(str(user_id), list(tids))
+        latencies.append(time.perf_counter() - t0)
+        return ok, result.get("status")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        results = list(pool.map(checkout, jobs))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2)
+
+    return {
+        "requests": args.requests,
+        "concurrency": args.concurrency,
+        "succeeded": sum(1 for ok, _ in results if ok),
+        "conflicts": sum(1 for ok, status in results if not ok and status == 409),
+        "errors": sum(1 for ok, status in results if not ok and status != 409),
+        "seconds": round(elapsed, 3),
+        "throughput_per_s": round(args.requests / elapsed, 1) if elapsed else None,
+        "latency_ms": {"p50": pct(0.50), "p95": pct(0.95), "p99": pct(0.99)},
+        "oversold": oversold(db, event_id),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent checkout benchmark")
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=64)
+    parser.add_argument("--seats", type=int, default=2000)
+    parser.add_argument("--hot-fraction", type=float, default=0.05, help="share of seats everybody competes for")
+    parser.add_argument("--per-order", type=int, default=2)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark database")
+    args = parser.parse_args()
+
+    from routes.orders import init_orders
+
+    client = MongoClient(os.getenv("MONGO_URI"), maxPoolSize=max(100, args.concurrency))
+    db_name = os.getenv("BENCH_DB_NAME", "ticket_marketplace_bench")
+    client.drop_database(db_name)
+    db = client[db_name]
+    try:
+        _, create_order = init_orders(db)
+        print(json.dumps(run(db, create_order, args), indent=2))
+    finally:
+        if not args.keep:
+            client.drop_database(db_name)
+
+if __name__ == "__main__":
+    main()
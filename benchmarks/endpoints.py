@@ -0,0 +1,404 @@
+"""Endpoint latency benchmark.
+
+Seeds a realistic dataset (events with seat-map tickets, a long order
+history, active carts), drives the hot endpoints of every blueprint with
+concurrent in-process clients and prints throughput and p50/p95/p99 latency
+per scenario as JSON.
+
+    python benchmarks/endpoints.py --profile full --concurrency 32 --out result.json
+    python benchmarks/endpoints.py --baseline baseline.json --max-regression 0.2
+    python benchmarks/endpoints.py --backend memory --profile small
+
+--backend mongo (default) uses MONGO_URI from the environment with a
+separate database (BENCH_DB_NAME, default ticket_marketplace_bench) that is
+dropped afterwards unless --keep is given. Redis is flushed before the run,
+so it must be a Redis database of its own: BENCH_REDIS_URL (e.g.
+redis://localhost:6379/15) is required and may not equal REDIS_URL.
+--backend memory runs fully offline on mongomock + fakeredis (both optional,
+pip install mongomock fakeredis[lua]); numbers from it are only comparable
+with other memory runs.
+
+Rate limits are switched off (RATE_LIMITS=off): the benchmark measures the
+endpoints, not the limiter. Only 2xx responses count towards throughput and
+latency; any other status is reported under "errors" (and in "status").
+
+With --baseline the run is compared against a saved result: any scenario
+whose p95 grows or throughput drops by more than --max-regression is
+reported and the exit code is 1. --save-baseline writes the current result.
+"""
+import argparse
+import contextlib
+import itertools
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from bson import ObjectId
+from bson.int64 import Int64
+from dotenv import load_dotenv
+
+load_dotenv()
+
+PROFILES = {
+    # events, tickets per event (seats + GA), orders, users, active carts
+    "small": {"events": 20, "seats": 400, "orders": 5_000, "users": 500, "carts": 50},
+    "full": {"events": 50, "seats": 1_000, "orders": 200_000, "users": 5_000, "carts": 1_000},
+}
+BATCH = 5_000
+
+def use_memory_backend():
+    """Swap pymongo/redis for mongomock/fakeredis before the app is imported"""
+    try:
+        import mongomock
+        import fakeredis
+    except ImportError:
+        sys.exit("--backend memory needs: pip install mongomock fakeredis[lua]")
+    import pymongo
+    import redis
+    server = fakeredis.FakeServer()
+
+    class MemoryRedis(fakeredis.FakeRedis):
+        def __init__(self, *args, **kwargs):
+            for k in ("socket_connect_timeout", "socket_timeout", "retry_on_timeout", "health_check_interval"):
+                kwargs.pop(k, None)
+            kwargs["server"] = server
+            super().__init__(*args, **kwargs)
+
+    redis.Redis = MemoryRedis
+    redis.from_url = lambda url, **kwargs: MemoryRedis(**kwargs)
+    pymongo.MongoClient = mongomock.MongoClient
+
+    # pymongo 4.9+ passes sort= to bulk builders (UpdateOne/ReplaceOne in
+    # bulk_write, e.g. stats.record_sale); mongomock does not know it
+    from mongomock.collection import BulkOperationBuilder
+    for name in ("add_update", "add_replace"):
+        def without_sort(self, *args, _add=getattr(BulkOperationBuilder, name), sort=None, **kwargs):
+            return _add(self, *args, **kwargs)
+        setattr(BulkOperationBuilder, name, without_sort)
+
+    # Operators the routes use that mongomock does not implement
+    from mongomock import aggregate
+    def union_with(in_collection, database, options):
+        return list(in_collection) + list(database[options["coll"]].aggregate(options.get("pipeline", [])))
+    aggregate._PIPELINE_HANDLERS.setdefault("$unionWith", union_with)
+    set_operator = aggregate._Parser._handle_set_operator
+    def handle_set_operator(self, operator, values):
+        if operator == "$setIntersection":
+            sets = [set(self.parse(v) or []) for v in values]
+            return list(set.intersection(*sets))
+        return set_operator(self, operator, values)
+    aggregate._Parser._handle_set_operator = handle_set_operator
+
+def _batches(it, size=BATCH):
+    it = iter(it)
+    while batch := list(itertools.islice(it, size)):
+        yield batch
+
+def seed(db, sizes, rnd):
+    """Dataset shaped like production: seat-map events, mostly historic orders"""
+    from routes.search import search_fields
+    from routes.seatmap import parse_seat_map, iter_tickets, count_tickets
+
+    venue_id = db.venues.insert_one({"name": "Bench Arena", "city": "Vilnius"}).inserted_id
+    organizer_id = db.organizers.insert_one({"name": "Bench Org", "email": "bench-org@example.com"}).inserted_id
+    user_ids = []
+    for batch in _batches({"name": f"Bench User {i}", "email": f"bench{i}@example.com",
+                           **search_fields(f"Bench User {i}", f"bench{i}@example.com")}
+                          for i in range(sizes["users"])):
+        user_ids += db.users.insert_many(batch).inserted_ids
+
+    rows = max(1, (sizes["seats"] // 2) // 50)
+    seat_map = parse_seat_map({
+        "ga": {"capacity": sizes["seats"] - rows * 50, "price": 25} if sizes["seats"] > rows * 50 else [],
+        "sections": [{"name": "", "rows": {"from": 1, "to": rows}, "seats": [1, 50], "price": 35}],
+    })
+    genres = ["Rock", "Jazz", "Opera", "Techno", "Folk", "Comedy", "Ballet", "Indie"]
+    now = datetime.now(timezone.utc)
+    event_ids, seat_ids, prices, event_of, events = [], [], {}, {}, {}
+    for i in range(sizes["events"]):
+        title = f"{rnd.choice(genres)} Night {i}"
+        event_id = db.events.insert_one({
+            "title": title, "eventDate": now + timedelta(days=i), "venueId": venue_id,
+            "organizerId": organizer_id, "seatMap": seat_map,
+            "ticketGeneration": {"status": "done", "generated": count_tickets(seat_map), "total": count_tickets(seat_map)},
+            **search_fields(title),
+        }).inserted_id
+        event_ids.append(event_id)
+        events[event_id] = (title, now + timedelta(days=i))
+        for batch in _batches(iter_tickets(event_id, seat_map)):
+            ids = db.tickets.insert_many(batch).inserted_ids
+            for t, tid in zip(batch, ids):
+                prices[tid] = int(t["price"])
+                event_of[tid] = event_id
+                if t["type"] == "seat":
+                    seat_ids.append(tid)
+
+    # A third of the seats is sold; the rest of the history is canceled orders
+    sold = rnd.sample(seat_ids, len(seat_ids) // 3)
+    all_ids = list(prices)
+    stats = {e: {"revenue": 0, "ticketsSold": 0} for e in event_ids}
+    def orders():
+        pending_sold = list(sold)
+        for n in range(sizes["orders"]):
+            if pending_sold:
+                tids, status = [pending_sold.pop()], "paid"
+            else:
+                tids, status = rnd.sample(all_ids, rnd.randint(1, 4)), "canceled"
+            total = sum(prices[t] for t in tids)
+            order_id = ObjectId()
+            if status == "paid":
+                for t in tids:
+                    stats[event_of[t]]["revenue"] += prices[t]
+                    stats[event_of[t]]["ticketsSold"] += 1
+            yield {
+                "_id": order_id, "userId": rnd.choice(user_ids),
+                "orderDate": now - timedelta(minutes=n), "status": status,
+                "totalPrice": Int64(total),
+                "items": [{"ticketId": t, "price": Int64(prices[t]), "eventId": event_of[t]} for t in tids],
+                "payment": {"totalAmount": Int64(total), "status": "paid" if status == "paid" else "failed",
+                    "paidAt": now if status == "paid" else None},
+                **({"_sold": tids} if status == "paid" else {}),
+            }
+    for batch in _batches(orders()):
+        sold_pairs = [(o.pop("_sold"), o["_id"]) for o in batch if "_sold" in o]
+        db.orders.insert_many(batch)
+        for tids, order_id in sold_pairs:
+            db.tickets.update_many({"_id": {"$in": tids}}, {"$set": {"status": "sold", "orderId": order_id}})
+
+    per_event = count_tickets(seat_map)
+    db.event_stats.insert_many([{
+        "_id": e, "title": events[e][0], "eventDate": events[e][1], "total": per_event,
+        "available": per_event - s["ticketsSold"], **s,
+    } for e, s in stats.items()])
+    return {"event_ids": event_ids, "user_ids": user_ids, "seat_ids": seat_ids, "sold": set(sold)}
+
+class Clients:
+    """One logged-in test client per worker thread"""
+
+    def __init__(self, app, emails):
+        self.app = app
+        self.emails = itertools.cycle(emails)
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def get(self):
+        c = getattr(self.local, "client", None)
+        if c is None:
+            with self.lock:
+                email = next(self.emails)
+            c = self.app.test_client()
+            c.post("/auth/login", json={"email": email})
+            self.local.client = c
+        return c
+
+def scenarios(data):
+    """name -> request function(client, rnd); one or two per blueprint"""
+    events = data["event_ids"]
+    free_seats = [s for s in data["seat_ids"] if s not in data["sold"] and s not in data["held"]]
+    random.Random(len(free_seats)).shuffle(free_seats)
+    # each order / checkout takes a seat nobody has taken yet (the ordering
+    # scenarios need warmup + requests seats each; then they reuse and 409)
+    unsold = iter(free_seats)
+
+    def next_seat(r):
+        return next(unsold, None) or r.choice(free_seats)
+
+    def checkout(c, r):
+        """Seat into the cart, then pay the whole cart"""
+        resp = c.post("/cart/items", json={"ticketId": str(next_seat(r))})
+        return c.post("/cart/checkout") if resp.status_code == 200 else resp
+
+    def order_and_pay(c, r):
+        """Pending order, then its payment"""
+        resp = c.post("/orders", json={"items": [{"ticketId": str(next_seat(r))}]})
+        return c.patch(f"/orders/{resp.json['_id']}/pay") if resp.status_code == 201 else resp
+
+    return {
+        "auth.login": lambda c, r: c.post("/auth/login", json={"email": f"bench{r.randrange(len(data['user_ids']))}@example.com"}),
+        "events.list": lambda c, r: c.get("/events?limit=20"),
+        "events.search": lambda c, r: c.get(f"/events?q={r.choice(['ro', 'jazz', 'night', 'op'])}&limit=20"),
+        "events.get": lambda c, r: c.get(f"/events/{r.choice(events)}"),
+        "tickets.list": lambda c, r: c.get(f"/tickets?eventId={r.choice(events)}"),
+        "users.list": lambda c, r: c.get("/users?limit=50"),
+        "analytics.top_events": lambda c, r: c.get("/analytics/top-events"),
+        "analytics.availability": lambda c, r: c.get("/analytics/availability"),
+        "cart.get": lambda c, r: c.get("/cart"),
+        "cart.add_ga": lambda c, r: c.post("/cart/items", json={"ticketId": "GA", "eventId": str(r.choice(events)), "quantity": 1}),
+        "orders.create_seat": lambda c, r: c.post("/orders", json={"items": [{"ticketId": str(next_seat(r))}]}),
+        "cart.checkout": checkout,
+        "orders.pay": order_and_pay,
+    }
+
+def seed_carts(clients, data, count, rnd):
+    """Active carts: users holding a GA ticket and a seat (data["held"])"""
+    seats = [s for s in data["seat_ids"] if s not in data["sold"]]
+    held = rnd.sample(seats, min(count, len(seats)))
+    data["held"] = set(held)
+    for seat in held:
+        c = clients.app.test_client()
+        c.post("/auth/login", json={"email": f"bench{rnd.randrange(len(data['user_ids']))}@example.com"})
+        c.post("/cart/items", json={"ticketId": str(seat)})
+        c.post("/cart/items", json={"ticketId": "GA", "eventId": str(rnd.choice(data["event_ids"])), "quantity": 1})
+
+def run_scenario(clients, fn, requests, concurrency, seed_):
+    """Throughput and latency of the 2xx responses; everything else is an error"""
+    latencies, statuses = [], {}
+    lock = threading.Lock()
+    def one(i):
+        rnd = random.Random(seed_ * 1_000_003 + i)
+        c = clients.get()
+        t0 = time.perf_counter()
+        resp = fn(c, rnd)
+        dt = time.perf_counter() - t0
+        with lock:
+            if 200 <= resp.status_code < 300:
+                latencies.append(dt)
+            statuses[resp.status_code] = statuses.get(resp.status_code, 0) + 1
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+
+    latencies.sort()
+    def pct(p):
+        if not latencies:
+            return None
+        return round(latencies[min(len(latencies) - 1, int(len(latencies) * p))] * 1000, 2)
+    return {
+        "requests": requests,
+        "seconds": round(elapsed, 3),
+        "throughput_per_s": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "latency_ms": {"p50": pct(0.50), "p95": pct(0.95), "p99": pct(0.99)},
+        "status": {str(k): v for k, v in sorted(statuses.items())},
+        "errors": requests - len(latencies),
+    }
+
+def compare(result, baseline, max_regression):
+    """Per-scenario change against a baseline; regressed when p95 grows or
+    throughput drops by more than max_regression (0.2 = 20%)"""
+    out = {}
+    for name, cur in result["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        if cur["latency_ms"]["p95"] is None:  # nothing succeeded
+            out[name] = {"regressed": True, "errors": cur["errors"]}
+            continue
+        p95_change = (cur["latency_ms"]["p95"] - base["latency_ms"]["p95"]) / base["latency_ms"]["p95"] if base["latency_ms"]["p95"] else 0.0
+        tput_change = (cur["throughput_per_s"] - base["throughput_per_s"]) / base["throughput_per_s"] if base["throughput_per_s"] else 0.0
+        out[name] = {
+            "p50_ms": [base["latency_ms"]["p50"], cur["latency_ms"]["p50"]],
+            "p95_ms": [base["latency_ms"]["p95"], cur["latency_ms"]["p95"]],
+            "p99_ms": [base["latency_ms"]["p99"], cur["latency_ms"]["p99"]],
+            "p95_change": round(p95_change, 3),
+            "throughput_change": round(tput_change, 3),
+            "regressed": p95_change > max_regression or tput_change < -max_regression,
+        }
+    return out
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except Exception:
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="Endpoint latency benchmark")
+    parser.add_argument("--backend", choices=["mongo", "memory"], default="mongo")
+    parser.add_argument("--profile", choices=sorted(PROFILES), default="small")
+    for k in PROFILES["small"]:
+        parser.add_argument(f"--{k}", type=int, help=f"override the profile's {k}")
+    parser.add_argument("--requests", type=int, default=500, help="requests per scenario")
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--warmup", type=int, default=50)
+    parser.add_argument("--only", help="comma separated scenario names (prefix match)")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--out", help="write the JSON result to this file")
+    parser.add_argument("--baseline", help="compare against a saved result")
+    parser.add_argument("--save-baseline", help="also write the result here")
+    parser.add_argument("--max-regression", type=float, default=0.2)
+    parser.add_argument("--keep", action="store_true", help="keep the benchmark database")
+    args = parser.parse_args()
+
+    sizes = {k: getattr(args, k) or v for k, v in PROFILES[args.profile].items()}
+    db_name = os.getenv("BENCH_DB_NAME", "ticket_marketplace_bench")
+    os.environ["DB_NAME"] = db_name  # read by app.py at import
+    os.environ["RATE_LIMITS"] = "off"
+    if args.backend == "memory":
+        use_memory_backend()
+    else:
+        # The run flushes Redis: never let it fall back to the app's own
+        redis_url = os.getenv("BENCH_REDIS_URL")
+        if not redis_url:
+            sys.exit("--backend mongo needs BENCH_REDIS_URL, a Redis database the benchmark may flush "
+                     "(e.g. redis://localhost:6379/15)")
+        if redis_url == os.getenv("REDIS_URL"):
+            sys.exit("BENCH_REDIS_URL must not be the app's REDIS_URL")
+        os.environ["REDIS_URL"] = redis_url  # read by redis_cache at import
+
+    # The app logs with print(); keep stdout for the JSON result
+    with contextlib.redirect_stdout(sys.stderr):
+        import app as appmod
+        from redis_cache import cache
+        from indexes import ensure_indexes
+        db = appmod.db
+        for name in db.list_collection_names():
+            db.drop_collection(name)
+        ensure_indexes(db)  # the startup build may have raced with the drop
+        if cache.redis_client:
+            cache.redis_client.flushdb()
+        rnd = random.Random(args.seed)
+        try:
+            t0 = time.perf_counter()
+            data = seed(db, sizes, rnd)
+            clients = Clients(appmod.app, [f"bench{i}@example.com" for i in range(sizes["users"])])
+            seed_carts(clients, data, sizes["carts"], rnd)
+            seed_seconds = round(time.perf_counter() - t0, 1)
+
+            result = {
+                "meta": {
+                    "backend": args.backend, "profile": args.profile, "dataset": sizes,
+                    "requests": args.requests, "concurrency": args.concurrency,
+                    "commit": _git_commit(), "started": datetime.now(timezone.utc).isoformat(),
+                    "seed_seconds": seed_seconds,
+                },
+                "scenarios": {},
+            }
+            only = [s.strip() for s in args.only.split(",")] if args.only else None
+            for n, (name, fn) in enumerate(scenarios(data).items()):
+                if only and not any(name.startswith(o) for o in only):
+                    continue
+                if args.warmup:
+                    run_scenario(clients, fn, args.warmup, args.concurrency, args.seed + 7919 * n)
+                result["scenarios"][name] = run_scenario(clients, fn, args.requests, args.concurrency, args.seed + n)
+                print(f"{name}: {result['scenarios'][name]['latency_ms']}", file=sys.stderr)
+        finally:
+            if not args.keep:
+                db.client.drop_database(db_name)
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline) as f:
+            result["comparison"] = compare(result, json.load(f), args.max_regression)
+        if any(c["regressed"] for c in result["comparison"].values()):
+            exit_code = 1
+    text = json.dumps(result, indent=2)
+    print(text)
+    for path in (args.out, args.save_baseline):
+        if path:
+            with open(path, "w") as f:
+                f.write(text + "\n")
+    sys.exit(exit_code)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,190 @@
+"""Lazily created, per-process MongoDB client.
+
+Nothing connects at import time. The first database access in a process
+creates its MongoClient, so under a pre-forking server (gunicorn, uwsgi)
+every worker opens its own pool after the fork and the master never holds
+sockets or monitor threads that would be copied into the children.
+
+Pool sizes are per process:
+  MONGO_MAX_POOL_SIZE (default 50), MONGO_MIN_POOL_SIZE (default 0)
+Redis is handled the same way inside RedisCache (REDIS_MAX_CONNECTIONS).
+
+Read routing: catalog and analytics blueprints get a LazyDatabase with
+REPLICA_READ (secondaryPreferred, bounded by MONGO_MAX_STALENESS seconds;
+MONGO_READ_REPLICAS=0 keeps everything on the primary, with no causal
+sessions or tokens at all). Orders, cart, checkout and auth use the
+primary handle. For read-your-writes, the
+operationTime of a request's writes is kept in the user's session, and
+later replica reads of that user run in a causally consistent session
+advanced to it (afterClusterTime), so a secondary answers only once it has
+caught up with the user's own writes.
+"""
+import functools
+import os
+import threading
+import time
+from contextvars import ContextVar
+from bson.int64 import Int64
+from bson.timestamp import Timestamp
+from pymongo import MongoClient, monitoring
+from pymongo.read_preferences import SecondaryPreferred, Primary
+from metrics import MongoMetrics
+
+MAX_STALENESS = int(os.getenv("MONGO_MAX_STALENESS", 90))  # s, server minimum is 90
+REPLICA_READS = os.getenv("MONGO_READ_REPLICAS", "1") == "1"
+REPLICA_READ = SecondaryPreferred(max_staleness=MAX_STALENESS) if REPLICA_READS else Primary()
+
+_clients = {}  # pid -> MongoClient
+_lock = threading.Lock()
+
+def mongo_client():
+    """This process's MongoClient (created on first use)"""
+    pid = os.getpid()
+    client = _clients.get(pid)
+    if client is None:
+        with _lock:
+            client = _clients.get(pid)
+            if client is None:
+                _clients.clear()  # inherited from the parent, never used here
+                client = MongoClient(
+                    os.getenv("MONGO_URI"),
+                    maxPoolSize=int(os.getenv("MONGO_MAX_POOL_SIZE", 50)),
+                    minPoolSize=int(os.getenv("MONGO_MIN_POOL_SIZE", 0)),
+                    connect=False,
+                    event_listeners=[MongoMetrics(), CausalTracker()],
+                )
+                _clients[pid] = client
+    return client
+
+class LazyDatabase:
+    """Stands in for a pymongo Database; resolves to the current process's
+    client on every access, so it can be created (and handed to init_*)
+    before any connection exists. With a read_preference, collection reads
+    also join the request's causal session (see causal_session)."""
+
+    def __init__(self, name, read_preference=None):
+        self.name = name
+        self.read_preference = read_preference
+
+    def get(self):
+        if self.read_preference is None:
+            return mongo_client()[self.name]
+        return mongo_client().get_database(self.name, read_preference=self.read_preference)
+
+    def _wrap(self, value):
+        if REPLICA_READS and self.read_preference is not None and hasattr(value, "count_documents"):
+            return _CausalReads(value)
+        return value
+
+    def __getattr__(self, attr):
+        return self._wrap(getattr(self.get(), attr))
+
+    def __getitem__(self, collection):
+        return self._wrap(self.get()[collection])
+
+    def __repr__(self):
+        return f"LazyDatabase({self.name!r})"
+
+# Read-your-writes
+
+_READ_METHODS = frozenset(("find", "find_one", "aggregate", "count_documents", "distinct"))
+_WRITE_COMMANDS = frozenset(("insert", "update", "delete", "findAndModify"))
+
+_request_state = ContextVar("causal_state", default=None)
+
+class _CausalReads:
+    """Collection proxy passing the request's causal session to reads"""
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, attr):
+        value = getattr(self._collection, attr)
+        if attr in _READ_METHODS:
+            session = causal_session()
+            if session is not None:
+                return functools.partial(value, session=session)
+        return value
+
+class CausalTracker(monitoring.CommandListener):
+    """Remembers the newest operationTime/$clusterTime of the request's writes"""
+
+    def started(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def succeeded(self, event):
+        state = _request_state.get()
+        if state is None or event.command_name not in _WRITE_COMMANDS:
+            return
+        op_time = event.reply.get("operationTime")
+        if op_time is not None and (state["wrote"] is None or op_time > state["wrote"][0]):
+            state["wrote"] = (op_time, event.reply.get("$clusterTime"))
+
+def _dump_token(op_time, cluster_time):
+    token = {"ot": [op_time.time, op_time.inc], "at": time.time()}
+    if cluster_time:
+        ct = cluster_time["clusterTime"]
+        token["ct"] = [ct.time, ct.inc]
+        sig = cluster_time.get("signature")
+        if sig:
+            token["sig"] = [bytes(sig["hash"]), int(sig["keyId"])]
+    return token
+
+def _load_token(token):
+    op_time = Timestamp(*token["ot"])
+    cluster_time = None
+    if "ct" in token:
+        cluster_time = {"clusterTime": Timestamp(*token["ct"])}
+        if "sig" in token:
+            cluster_time["signature"] = {"hash": token["sig"][0], "keyId": Int64(token["sig"][1])}
+    return op_time, cluster_time
+
+def causal_session():
+    """The request's causally consistent session, advanced to the user's
+    last write, or None when the user has no recent write to wait for"""
+    state = _request_state.get()
+    if state is None or state["token"] is None:
+        return None
+    if state["session"] is None:
+        op_time, cluster_time = _load_token(state["token"])
+        session = mongo_client().start_session(causal_consistency=True)
+        if cluster_time:
+            session.advance_cluster_time(cluster_time)
+        session.advance_operation_time(op_time)
+        state["session"] = session
+    return state["session"]
+
+def init_causal_reads(app):
+    """Carry write times from one request to the next in the Flask session.
+    Nothing to do when reads stay on the primary (MONGO_READ_REPLICAS=0)."""
+    from flask import session, request
+
+    if not REPLICA_READS:
+        return
+
+    @app.before_request
+    def _start_causal_state():
+        token = session.get("causal")
+        if token and time.time() - token.get("at", 0) > MAX_STALENESS:
+            token = None  # every eligible secondary has caught up by now
+        request.environ["app.causal_token"] = _request_state.set(
+            {"token": token, "session": None, "wrote": None})
+
+    @app.after_request
+    def _save_causal_token(response):
+        state = _request_state.get()
+        if state and state["wrote"]:
+            session["causal"] = _dump_token(*state["wrote"])
+        return response
+
+    @app.teardown_request
+    def _end_causal_state(exc):
+        state = _request_state.get()
+        if state and state["session"] is not None:
+            state["session"].end_session()
+        token = request.environ.pop("app.causal_token", None)
+        if token is not None:
+            _request_state.reset(token)
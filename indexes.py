@@ -0,0 +1,147 @@
+"""Declared MongoDB indexes and query-plan checks.
+
+INDEXES lists every index the routes rely on, per collection. ensure_indexes()
+creates whatever is missing (idempotent; run on startup or with
+`flask ensure-indexes`). canonical_queries() builds the hot queries of each
+route with the same helpers the routes use (filters, listing sort with its
+_id tiebreak); check_indexes() explains them and reports any plan that falls
+back to a COLLSCAN (`flask check-indexes` exits non-zero on failure).
+
+When a route gains a new query shape, add it here together with its index.
+"""
+import os
+import threading
+from datetime import datetime
+from bson import ObjectId
+from pymongo import ASCENDING as ASC, DESCENDING as DESC, IndexModel
+
+INDEXES = {
+    "users": [
+        IndexModel([("email", ASC)], unique=True),
+        IndexModel([("name", ASC), ("_id", ASC)]),
+        IndexModel([("searchTokens", ASC)]),
+    ],
+    "organizers": [
+        IndexModel([("email", ASC)]),
+    ],
+    "events": [
+        IndexModel([("eventDate", ASC), ("_id", ASC)]),
+        IndexModel([("organizerId", ASC), ("eventDate", ASC)]),
+        IndexModel([("venueId", ASC), ("eventDate", ASC)]),
+        IndexModel([("searchTokens", ASC)]),
+    ],
+    "tickets": [
+        IndexModel([("eventId", ASC), ("status", ASC)]),
+        IndexModel([("eventId", ASC), ("type", ASC), ("price", ASC)]),
+        # seat-map generation relies on this to skip already inserted tickets on resume
+        IndexModel([("eventId", ASC), ("seatKey", ASC)], unique=True,
+                   partialFilterExpression={"seatKey": {"$exists": True}}),
+    ],
+    "orders": [
+        IndexModel([("items.ticketId", ASC)]),
+        IndexModel([("status", ASC), ("orderDate", DESC)]),
+        IndexModel([("userId", ASC), ("orderDate", DESC)]),
+        # pending-order sweeper; paid/canceled orders carry no expiresAt
+        IndexModel([("expiresAt", ASC)], partialFilterExpression={"status": "pending"}),
+    ],
+    "event_stats": [
+        IndexModel([("revenue", DESC)]),
+        IndexModel([("available", DESC)]),
+    ],
+}
+
+# Placeholder ids and values are fine, explain only needs the query shape
+_ID = ObjectId("000000000000000000000000")
+_NOW = datetime(2026, 1, 1)
+
+def canonical_queries():
+    """[(collection, name, find command body)] as the routes issue them"""
+    from routes.utils import listing_sort
+    from routes.search import apply_search
+    from routes.tickets import ticket_query
+    from routes.expiry import expired_filter, SWEEP_BATCH
+
+    def find(filter_, sort=None, limit=None):
+        body = {"filter": filter_}
+        if sort:
+            body["sort"] = dict(sort)
+        if limit:
+            body["limit"] = limit
+        return body
+
+    def search(text):
+        q = {}
+        apply_search(q, text)
+        return q
+
+    return [
+        ("users", "login by email", find({"email": "x@example.com"})),
+        ("users", "list users", find({}, listing_sort("name", 1))),
+        ("users", "search users", find(search("jo"), listing_sort("name", 1))),
+        ("organizers", "login by email", find({"email": "x@example.com"})),
+        ("events", "list events", find({}, listing_sort("eventDate", 1))),
+        ("events", "events by organizer", find({"organizerId": _ID}, listing_sort("eventDate", 1))),
+        ("events", "events by venue", find({"venueId": _ID}, listing_sort("eventDate", 1))),
+        ("events", "search events", find(search("ro"), listing_sort("eventDate", 1))),
+        ("tickets", "available tickets of event", find(ticket_query({}, _ID)[0])),
+        ("tickets", "tickets of event by type and price",
+         find(ticket_query({"type": "seat", "minPrice": "0", "maxPrice": "50"}, _ID)[0])),
+        ("orders", "expired pending orders", find(expired_filter(_NOW), [("expiresAt", 1)], SWEEP_BATCH)),
+        ("event_stats", "top events", find({"ticketsSold": {"$gt": 0}}, [("revenue", -1)], 10)),
+        ("event_stats", "availability", find({"ticketsSold": {"$gt": 0}}, [("available", -1)])),
+    ]
+
+def ensure_indexes(db):
+    """Create all declared indexes; returns {collection: [index names]}.
+    A failing collection (e.g. duplicates under a unique index) is reported
+    and skipped so the others still get built."""
+    created = {}
+    for coll, models in INDEXES.items():
+        try:
+            created[coll] = db[coll].create_indexes(models)
+        except Exception as e:
+            print(f"Index build failed for {coll}: {e}")
+            created[coll] = []
+    return created
+
+def start_index_build(db, once_per=0):
+    """ensure_indexes() on a background thread so startup is not blocked.
+    With once_per=N only one process per N seconds actually builds (a Redis
+    lock), so a fleet of freshly started workers does not repeat the work."""
+    def run():
+        if once_per:
+            from redis_cache import cache
+            r = cache.redis_client
+            if r and not r.set("bootstrap:indexes", os.getpid(), nx=True, ex=once_per):
+                return
+        try:
+            ensure_indexes(db)
+        except Exception as e:
+            print(f"Index build failed: {e}")
+    t = threading.Thread(target=run, name="ensure-indexes", daemon=True)
+    t.start()
+    return t
+
+def _stages(plan):
+    """All stage names of an explain plan tree"""
+    if not isinstance(plan, dict):
+        return
+    if "stage" in plan:
+        yield plan["stage"]
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            yield from _stages(plan[key])
+    for child in plan.get("inputStages", []):
+        yield from _stages(child)
+
+def check_indexes(db):
+    """Explain every canonical query; returns a list of failures
+    [(collection, name, stages)] for plans that contain a COLLSCAN."""
+    failures = []
+    for coll, name, body in canonical_queries():
+        res = db.command("explain", {"find": coll, **body}, verbosity="queryPlanner")
+        winning = res.get("queryPlanner", {}).get("winningPlan", {})
+        stages = list(_stages(winning))
+        if "COLLSCAN" in stages:
+            failures.append((coll, name, stages))
+    return failures
@@ -0,0 +1,258 @@
+"""Per-request round-trip instrumentation.
+
+Every request gets a small counter set (a ContextVar, so it follows the
+request thread or task) that is filled by:
+  - MongoMetrics    - pymongo command monitoring (passed to MongoClient)
+  - instrument_redis - wraps a redis client; one call per command, and one
+                      per pipeline execute (a single round trip)
+  - timed("serialize") - JSON responses and cache codec work
+At the end of the request the totals are observed into per-endpoint
+histograms, served in Prometheus text format at /debug/metrics, and with
+SERVER_TIMING=1 each response also gets a Server-Timing header.
+
+Histograms are per process; scrape every worker (or aggregate upstream).
+"""
+import inspect
+import os
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import wraps
+from pymongo import monitoring
+
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"
+
+_current = ContextVar("request_metrics", default=None)
+
+class RequestStats:
+    __slots__ = ("mongo_calls", "mongo_seconds", "mongo_commands", "redis_calls", "redis_seconds",
+                 "serialize_seconds", "started")
+
+    def __init__(self):
+        self.mongo_calls = 0
+        self.mongo_seconds = 0.0
+        self.mongo_commands = {}
+        self.redis_calls = 0
+        self.redis_seconds = 0.0
+        self.serialize_seconds = 0.0
+        self.started = time.perf_counter()
+
+def current():
+    """Stats of the request being served, or None outside a request"""
+    return _current.get()
+
+# Histograms
+
+TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+class Histogram:
+    def __init__(self, name, help_, buckets):
+        self.name = name
+        self.help = help_
+        self.buckets = buckets
+        self._series = {}  # endpoint -> [bucket counts..., +Inf, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, endpoint, value):
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            s = self._series.get(endpoint)
+            if s is None:
+                s = self._series[endpoint] = [0] * (len(self.buckets) + 2)
+            s[i] += 1
+            s[-1] += value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = {k: list(v) for k, v in self._series.items()}
+        for endpoint, s in sorted(series.items()):
+            label = f'endpoint="{endpoint}"'
+            cumulative = 0
+            for bound, n in zip(self.buckets, s):
+                cumulative += n
+                lines.append(f'{self.name}_bucket{{{label},le="{bound}"}} {cumulative}')
+            cumulative += s[len(self.buckets)]
+            lines.append(f'{self.name}_bucket{{{label},le="+Inf"}} {cumulative}')
+            lines.append(f"{self.name}_sum{{{label}}} {round(s[-1], 6)}")
+            lines.append(f"{self.name}_count{{{label}}} {cumulative}")
+        return lines
+
+class Counter:
+    def __init__(self, name, help_, labels):
+        self.name = name
+        self.help = help_
+        self.labels = labels
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, label_values, n=1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + n
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            values = dict(self._values)
+        for lv, n in sorted(values.items()):
+            label = ",".join(f'{k}="{v}"' for k, v in zip(self.labels, lv))
+            lines.append(f"{self.name}{{{label}}} {n}")
+        return lines
+
+REQUEST_SECONDS = Histogram("app_request_duration_seconds", "Request handling time", TIME_BUCKETS)
+MONGO_CALLS = Histogram("app_mongo_commands_per_request", "Mongo commands per request", COUNT_BUCKETS)
+MONGO_SECONDS = Histogram("app_mongo_seconds_per_request", "Time in Mongo commands per request", TIME_BUCKETS)
+REDIS_CALLS = Histogram("app_redis_calls_per_request", "Redis round trips per request", COUNT_BUCKETS)
+REDIS_SECONDS = Histogram("app_redis_seconds_per_request", "Time in Redis calls per request", TIME_BUCKETS)
+SERIALIZE_SECONDS = Histogram("app_serialize_seconds_per_request", "Time serializing responses and cache values", TIME_BUCKETS)
+MONGO_COMMANDS = Counter("app_mongo_commands_total", "Mongo commands by endpoint and command", ("endpoint", "command"))
+_ALL = (REQUEST_SECONDS, MONGO_CALLS, MONGO_SECONDS, REDIS_CALLS, REDIS_SECONDS, SERIALIZE_SECONDS, MONGO_COMMANDS)
+
+def render():
+    """All metrics in Prometheus text exposition format"""
+    lines = []
+    for m in _ALL:
+        lines.extend(m.render())
+    return "\n".join(lines) + "\n"
+
+# Sources
+
+class MongoMetrics(monitoring.CommandListener):
+    """Counts commands and their time for the current request"""
+
+    def started(self, event):
+        pass
+
+    def _record(self, event):
+        stats = _current.get()
+        if stats is None:
+            return
+        stats.mongo_calls += 1
+        stats.mongo_seconds += event.duration_micros / 1e6
+        stats.mongo_commands[event.command_name] = stats.mongo_commands.get(event.command_name, 0) + 1
+
+    succeeded = _record
+    failed = _record
+
+def _timed_redis(fn):
+    @wraps(fn)
+    def wrapper(*args, **kwargs):
+        stats = _current.get()
+        if stats is None:
+            return fn(*args, **kwargs)
+        t0 = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            stats.redis_calls += 1
+            stats.redis_seconds += time.perf_counter() - t0
+    return wrapper
+
+def _timed_redis_async(fn):
+    @wraps(fn)
+    async def wrapper(*args, **kwargs):
+        stats = _current.get()
+        if stats is None:
+            return await fn(*args, **kwargs)
+        t0 = time.perf_counter()
+        try:
+            return await fn(*args, **kwargs)
+        finally:
+            stats.redis_calls += 1
+            stats.redis_seconds += time.perf_counter() - t0
+    return wrapper
+
+def instrument_redis(client):
+    """Time every command of a redis client (sync or redis.asyncio); a
+    pipeline counts once"""
+    if client is None or getattr(client, "_instrumented", False):
+        return client
+    timed_call = _timed_redis_async if inspect.iscoroutinefunction(client.execute_command) else _timed_redis
+    client.execute_command = timed_call(client.execute_command)
+    make_pipeline = client.pipeline
+
+    @wraps(make_pipeline)
+    def pipeline(*args, **kwargs):
+        pipe = make_pipeline(*args, **kwargs)
+        pipe.execute = timed_call(pipe.execute)
+        return pipe
+
+    client.pipeline = pipeline
+    client._instrumented = True
+    return client
+
+@contextmanager
+def timed(kind):
+    """with timed("serialize"): ... adds the block's time to the request"""
+    stats = _current.get()
+    if stats is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        if kind == "serialize":
+            stats.serialize_seconds += time.perf_counter() - t0
+
+# Flask / Quart wiring
+
+def _observe_request(endpoint, response):
+    """Record the current request's totals under its endpoint"""
+    stats = _current.get()
+    if stats is None:
+        return response
+    endpoint = endpoint or "unmatched"
+    elapsed = time.perf_counter() - stats.started
+    REQUEST_SECONDS.observe(endpoint, elapsed)
+    MONGO_CALLS.observe(endpoint, stats.mongo_calls)
+    MONGO_SECONDS.observe(endpoint, stats.mongo_seconds)
+    REDIS_CALLS.observe(endpoint, stats.redis_calls)
+    REDIS_SECONDS.observe(endpoint, stats.redis_seconds)
+    SERIALIZE_SECONDS.observe(endpoint, stats.serialize_seconds)
+    for command, n in stats.mongo_commands.items():
+        MONGO_COMMANDS.inc((endpoint, command), n)
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = (
+            f'mongo;dur={stats.mongo_seconds * 1000:.2f};desc="{stats.mongo_calls} cmds", '
+            f'redis;dur={stats.redis_seconds * 1000:.2f};desc="{stats.redis_calls} calls", '
+            f"serialize;dur={stats.serialize_seconds * 1000:.2f}, "
+            f"total;dur={elapsed * 1000:.2f}"
+        )
+    return response
+
+def init_metrics(app):
+    """Start/finish request stats around every request"""
+    from flask import request
+
+    @app.before_request
+    def _start_request_metrics():
+        request.environ["app.metrics_token"] = _current.set(RequestStats())
+
+    @app.after_request
+    def _finish_request_metrics(response):
+        return _observe_request(request.endpoint, response)
+
+    @app.teardown_request
+    def _reset_request_metrics(exc):
+        token = request.environ.pop("app.metrics_token", None)
+        if token is not None:
+            _current.reset(token)
+
+def init_async_metrics(app):
+    """init_metrics() for the Quart app in asgi.py. The hooks must be
+    coroutines: Quart runs sync hooks in a thread, where the ContextVar set
+    for the request would not reach the view. Each request runs in its own
+    task (own context copy), so there is nothing to reset afterwards."""
+    from quart import request
+
+    @app.before_request
+    async def _start_request_metrics():
+        _current.set(RequestStats())
+
+    @app.after_request
+    async def _finish_request_metrics(response):
+        return _observe_request(request.endpoint, response)
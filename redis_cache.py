@@ -1,95 +1,466 @@
 import redis
 import json
 import os
+import time
+import uuid
+import threading
+import zlib
+from collections import OrderedDict
 from functools import wraps
 from datetime import timedelta
 from typing import Any, Optional, Callable
 from dotenv import load_dotenv
+from serialization import CacheCodec
+from metrics import instrument_redis
 
 load_dotenv()
 
+# Namespaced keys look like "<namespace>:<generation>:<key>". The generation
+# counter lives in "<namespace>:gen"; bumping it (one INCR) orphans every entry
+# of the namespace at once and the old entries simply age out through TTL.
+# Resolving the generation and touching the key happen in one Lua call.
+_NS_SCRIPTS = {
+    "get": """
+local gen = redis.call('GET', KEYS[1]) or '0'
+return redis.call('GET', ARGV[1] .. ':' .. gen .. ':' .. ARGV[2])
+""",
+    "set": """
+local gen = redis.call('GET', KEYS[1]) or '0'
+return redis.call('SET', ARGV[1] .. ':' .. gen .. ':' .. ARGV[2], ARGV[3], 'EX', ARGV[4])
+""",
+    "delete": """
+local gen = redis.call('GET', KEYS[1]) or '0'
+return redis.call('DEL', ARGV[1] .. ':' .. gen .. ':' .. ARGV[2])
+""",
+    # Returns {generation, value} so a recomputed value can be written back
+    # under the generation it was read from, never into a newer one.
+    "entry": """
+local gen = redis.call('GET', KEYS[1]) or '0'
+return {gen, redis.call('GET', ARGV[1] .. ':' .. gen .. ':' .. ARGV[2])}
+""",
+}
+
+# Compare-and-delete, so a worker only ever releases its own lock
+_UNLOCK_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then return redis.call('DEL', KEYS[1]) end
+return 0
+"""
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+class LocalCache:
+    """Bounded in-process LRU with per-entry TTL, used as a first tier in
+    front of Redis. Values are shared between callers - treat them as read-only."""
+    
+    def __init__(self, max_size: int, ttl: float):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._data = OrderedDict()  # key -> (expires_at, value)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def get(self, key):
+        now = time.monotonic()
+        with self._lock:
+            item = self._data.get(key)
+            if item is None or item[0] <= now:
+                if item is not None:
+                    del self._data[key]
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return item[1]
+    
+    def set(self, key, value, ttl: Optional[float] = None):
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        if ttl <= 0:
+            return
+        with self._lock:
+            self._data[key] = (time.monotonic() + ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+                self.evictions += 1
+    
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+    
+    def clear_namespace(self, namespace):
+        with self._lock:
+            for k in [k for k in self._data if k[0] == namespace]:
+                del self._data[k]
+    
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+    
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "size": len(self._data),
+            "max_size": self.max_size,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hit_ratio": round(self.hits / total, 3) if total else None,
+        }
+
 class RedisCache:
     """Redis cache class for data storage and management"""
     
+    # After a failed connect, try again at most this often (s)
+    RETRY_INTERVAL = 5.0
+
     def __init__(self):
-        # Cloud Redis connection using URL
+        # Clients are created lazily, once per process (see _open): nothing
+        # connects at import, and forked workers never share sockets
+        self._redis = None
+        self._value = None
+        self._pid = None
+        self._retry_at = 0.0
+        self._open_lock = threading.Lock()
+        self._ns_scripts = {}
+        
+        # Default cache TTL (Time-To-Live) in seconds
+        self.default_ttl = int(os.getenv('REDIS_DEFAULT_TTL', 60))  # Reduced to 60s
+        
+        # Cached values are encoded by a pluggable codec (JSON or msgpack,
+        # optionally compressed) and go through a binary-safe client
+        self.codec = CacheCodec(
+            os.getenv('REDIS_CACHE_CODEC', 'json'),
+            compress_min=int(os.getenv('REDIS_CACHE_COMPRESS_MIN', 0))
+        )
+        
+        # Optional in-process tier (disabled unless REDIS_LOCAL_CACHE_SIZE > 0).
+        # Workers keep each other coherent over a pub/sub invalidation channel.
+        local_size = int(os.getenv('REDIS_LOCAL_CACHE_SIZE', 0))
+        self.local = LocalCache(local_size, float(os.getenv('REDIS_LOCAL_CACHE_TTL', 5))) if local_size > 0 else None
+        self._instance_id = uuid.uuid4().hex
+        self._pubsub_thread = None
+        self._pubsub_pid = None
+
+    def _open(self):
+        """Connect (or reconnect after a fork / failed attempt) and ping once"""
+        with self._open_lock:
+            pid = os.getpid()
+            if self._pid == pid and (self._redis is not None or time.time() < self._retry_at):
+                return
+            if self._pid != pid and self.local:
+                self.local.clear()  # copied from the parent process
+            self._pid = pid
+            self._redis = self._value = None
+            # Cloud Redis connection using URL
+            if os.getenv('REDIS_URL'):
+                print(f"Connecting to Redis Cloud...")
+            else:
+                # Fallback to local Redis
+                print("Connecting to local Redis...")
+            client = instrument_redis(self._connect(decode_responses=True))
+            
+            # Check connection
+            try:
+                client.ping()
+                print("Redis connection was successful")
+            except Exception as e:
+                print(f"Redis connection error: {e}")
+                self._retry_at = time.time() + self.RETRY_INTERVAL  # Failsafe
+                return
+            
+            self._value = instrument_redis(self._connect(decode_responses=False))
+            self._ns_scripts = {name: self._value.register_script(src) for name, src in _NS_SCRIPTS.items()}
+            self._unlock = client.register_script(_UNLOCK_SCRIPT)
+            self._redis = client
+
+    @property
+    def redis_client(self):
+        """Text client, or None while Redis is unreachable"""
+        if self._pid != os.getpid() or (self._redis is None and time.time() >= self._retry_at):
+            self._open()
+        return self._redis
+
+    @property
+    def value_client(self):
+        """Binary client for cached values (see codec)"""
+        return self._value if self.redis_client else None
+    
+    @staticmethod
+    def _connect(decode_responses: bool, client_module=redis):
+        """Client from REDIS_URL / REDIS_HOST...; client_module=redis.asyncio
+        gives the async flavour with the same settings. REDIS_MAX_CONNECTIONS
+        caps each client's pool (per process)"""
+        max_connections = int(os.getenv('REDIS_MAX_CONNECTIONS', 0)) or None
         redis_url = os.getenv('REDIS_URL')
         if redis_url:
-            print(f"Connecting to Redis Cloud...")
-            self.redis_client = redis.from_url(
+            return client_module.from_url(
                 redis_url,
-                decode_responses=True,
+                decode_responses=decode_responses,
                 socket_connect_timeout=10,
                 socket_timeout=10,
                 retry_on_timeout=True,
-                health_check_interval=30
-            )
-        else:
-            # Fallback to local Redis
-            print("Connecting to local Redis...")
-            self.redis_client = redis.Redis(
-                host=os.getenv('REDIS_HOST', 'localhost'),
-                port=int(os.getenv('REDIS_PORT', 6379)),
-                password=os.getenv('REDIS_PASSWORD'),
-                db=int(os.getenv('REDIS_DB', 0)),
-                decode_responses=True
+                health_check_interval=30,
+                max_connections=max_connections
             )
-        
-        # Default cache TTL (Time-To-Live) in seconds
-        self.default_ttl = int(os.getenv('REDIS_DEFAULT_TTL', 60))  # Reduced to 60s
-        
-        # Check connection
+        return client_module.Redis(
+            host=os.getenv('REDIS_HOST', 'localhost'),
+            port=int(os.getenv('REDIS_PORT', 6379)),
+            password=os.getenv('REDIS_PASSWORD'),
+            db=int(os.getenv('REDIS_DB', 0)),
+            decode_responses=decode_responses,
+            max_connections=max_connections
+        )
+    
+    def _ensure_subscriber(self):
+        """Start the invalidation listener (once per process)"""
+        if not self.local or not self.redis_client or self._pubsub_pid == os.getpid():
+            return
+        self._pubsub_pid = os.getpid()
         try:
-            self.redis_client.ping()
-            print("Redis connection was successful")
-        except Exception as e:
-            print(f"Redis connection error: {e}")
-            self.redis_client = None  # Failsafe
+            pubsub = self.redis_client.pubsub(ignore_subscribe_messages=True)
+            pubsub.subscribe(**{INVALIDATION_CHANNEL: self._on_invalidation})
+            self._pubsub_thread = pubsub.run_in_thread(sleep_time=1, daemon=True)
+        except redis.RedisError as e:
+            print(f"Redis error starting cache invalidation listener: {e}")
+            self.local.clear()
+    
+    def _on_invalidation(self, message):
+        try:
+            msg = json.loads(message["data"])
+        except (TypeError, ValueError):
+            return
+        if msg.get("from") == self._instance_id:
+            return
+        if msg.get("op") == "ns":
+            self.local.clear_namespace(msg.get("ns"))
+        else:
+            self._local_evict(msg.get("ns"), msg.get("key"))
+    
+    def _local_evict(self, namespace, key):
+        if self.local:
+            self.local.delete((namespace, key))
+            self.local.delete((namespace, key, "entry"))
     
-    def get(self, key: str) -> Optional[Any]:
-        """Get value from Redis cache by key"""
+    def _publish(self, client, op: str, namespace: Optional[str], key: Optional[str] = None):
+        if self.local:
+            client.publish(INVALIDATION_CHANNEL, json.dumps(
+                {"op": op, "ns": namespace, "key": key, "from": self._instance_id}
+            ))
+    
+    def _ns_call(self, op: str, namespace: str, key: str, *args):
+        return self._ns_scripts[op](keys=[f"{namespace}:gen"], args=[namespace, key, *args])
+    
+    def get(self, key: str, namespace: Optional[str] = None) -> Optional[Any]:
+        """Get value from Redis cache by key (optionally within a namespace)"""
         if not self.redis_client:
             return None
+        if self.local:
+            self._ensure_subscriber()
+            value = self.local.get((namespace, key))
+            if value is not None:
+                return value
         try:
-            value = self.redis_client.get(key)
+            if namespace:
+                value = self._ns_call("get", namespace, key)
+            else:
+                value = self.value_client.get(key)
             if value:
-                return json.loads(value)
+                value = self.codec.loads(value)
+                if self.local:
+                    self.local.set((namespace, key), value)
+                return value
             return None
-        except (redis.RedisError, json.JSONDecodeError):
+        except (redis.RedisError, ValueError, zlib.error):
             return None
     
-    def set(self, key: str, value: Any, ttl: Optional[int] = None) -> bool:
-        """Write value to Redis cache with optional TTL"""
+    def set(self, key: str, value: Any, ttl: Optional[int] = None, namespace: Optional[str] = None) -> bool:
+        """Write value to Redis cache with optional TTL (optionally within a namespace)"""
         if not self.redis_client:
             return False
         try:
             ttl = ttl or self.default_ttl
-            # Convert object to JSON string
-            serialized = json.dumps(value, default=str)
-            return bool(self.redis_client.setex(key, ttl, serialized))
-        except (redis.RedisError, TypeError):
+            serialized = self.codec.dumps(value)
+            pipe = self.value_client.pipeline(transaction=False)
+            if namespace:
+                self._ns_scripts["set"](keys=[f"{namespace}:gen"], args=[namespace, key, serialized, ttl], client=pipe)
+            else:
+                pipe.setex(key, ttl, serialized)
+            self._publish(pipe, "del", namespace, key)
+            ok = bool(pipe.execute()[0])
+            if self.local:
+                self.local.set((namespace, key), self.codec.loads(serialized), ttl)
+            return ok
+        except (redis.RedisError, TypeError, ValueError):
             return False
     
-    def delete(self, key: str) -> bool:
+    def delete(self, key: str, namespace: Optional[str] = None) -> bool:
         """Delete key from Redis cache"""
         if not self.redis_client:
             return False
+        self._local_evict(namespace, key)
         try:
-            return bool(self.redis_client.delete(key))
+            pipe = self.redis_client.pipeline(transaction=False)
+            if namespace:
+                self._ns_scripts["delete"](keys=[f"{namespace}:gen"], args=[namespace, key], client=pipe)
+            else:
+                pipe.delete(key)
+            self._publish(pipe, "del", namespace, key)
+            return bool(pipe.execute()[0])
         except redis.RedisError:
             return False
     
-    def clear_pattern(self, pattern: str) -> int:
-        """Delete all keys matching pattern (e.g. 'analytics*')"""
+    def invalidate_namespace(self, namespace: str) -> Optional[int]:
+        """Invalidate every key of a namespace with a single INCR"""
         if not self.redis_client:
-            return 0
+            return None
+        if self.local:
+            self.local.clear_namespace(namespace)
+        try:
+            pipe = self.redis_client.pipeline(transaction=False)
+            pipe.incr(f"{namespace}:gen")
+            self._publish(pipe, "ns", namespace)
+            return pipe.execute()[0]
+        except redis.RedisError as e:
+            print(f"Redis error in invalidate_namespace: {e}")
+            return None
+    
+    def get_or_compute(self, key: str, compute: Callable[[], Any], ttl: Optional[int] = None,
+                       namespace: Optional[str] = None, stale_ttl: int = 0,
+                       lock_ttl: int = 30, wait_timeout: float = 5.0) -> Any:
+        """Read-through cache with single-flight recomputation.
+        
+        On a miss only the worker holding a short Redis lock runs compute();
+        the others wait for its result (or, in soft-TTL mode, get the previous
+        value right away). With stale_ttl > 0 the value is served for stale_ttl
+        seconds past ttl while a single background refresh runs.
+        """
+        if not self.redis_client:
+            return compute()
+        ttl = ttl or self.default_ttl
+        ns = namespace or "cache"
+        lock_key = f"{ns}:lock:{key}"
+        last_key = f"{ns}:last:{key}"
+        
+        gen, entry = self._read_entry(key, namespace)
+        if entry is not None:
+            if entry["soft"] > time.time():
+                return entry["v"]
+            # Soft-expired: serve stale, one worker refreshes in the background
+            token = self._lock(lock_key, lock_ttl)
+            if token:
+                threading.Thread(
+                    target=self._refresh, daemon=True,
+                    args=(key, namespace, gen, compute, ttl, stale_ttl, lock_key, last_key, token)
+                ).start()
+            return entry["v"]
+        
+        token = self._lock(lock_key, lock_ttl)
+        if token:
+            try:
+                return self._store(key, namespace, gen, compute(), ttl, stale_ttl, last_key)
+            finally:
+                self._release(lock_key, token)
+        
+        # Someone else is recomputing
+        if stale_ttl:
+            previous = self._read_value(last_key)
+            if previous is not None:
+                return previous["v"]
+        deadline = time.time() + wait_timeout
+        while time.time() < deadline:
+            time.sleep(0.05)
+            _, entry = self._read_entry(key, namespace)
+            if entry is not None:
+                return entry["v"]
+        return compute()  # lock holder is too slow or died
+    
+    def _read_entry(self, key, namespace):
+        if self.local:
+            self._ensure_subscriber()
+            cached = self.local.get((namespace, key, "entry"))
+            if cached is not None:
+                return cached
         try:
-            keys = self.redis_client.keys(pattern)
-            if keys:
-                deleted = self.redis_client.delete(*keys)
-                return deleted
-            print(f"No keys found for pattern '{pattern}'")
+            if namespace:
+                gen, raw = self._ns_call("entry", namespace, key)
+                gen = gen.decode()
+            else:
+                gen, raw = None, self.value_client.get(key)
+            entry = self.codec.loads(raw) if raw else None
+            if self.local and entry is not None:
+                self.local.set((namespace, key, "entry"), (gen, entry), entry["soft"] - time.time())
+            return gen, entry
+        except (redis.RedisError, TypeError, ValueError, zlib.error):
+            return None, None
+    
+    def _read_value(self, key):
+        try:
+            raw = self.value_client.get(key)
+            return self.codec.loads(raw) if raw else None
+        except (redis.RedisError, ValueError, zlib.error):
+            return None
+    
+    def _store(self, key, namespace, gen, value, ttl, stale_ttl, last_key):
+        if namespace and gen is None:
+            return value  # generation unknown (Redis error): a ns:None: key would never be invalidated
+        try:
+            serialized = self.codec.dumps({"v": value, "soft": time.time() + ttl})
+            full_key = f"{namespace}:{gen}:{key}" if namespace else key
+            pipe = self.value_client.pipeline(transaction=False)
+            pipe.setex(full_key, ttl + stale_ttl, serialized)
+            if stale_ttl:
+                # Survives namespace invalidation, served while a new value is computed
+                pipe.setex(last_key, ttl + stale_ttl, serialized)
+            self._publish(pipe, "del", namespace, key)
+            pipe.execute()
+            self._local_evict(namespace, key)
+        except (redis.RedisError, TypeError, ValueError) as e:
+            print(f"Redis error in get_or_compute: {e}")
+        return value
+    
+    def _refresh(self, key, namespace, gen, compute, ttl, stale_ttl, lock_key, last_key, token):
+        try:
+            self._store(key, namespace, gen, compute(), ttl, stale_ttl, last_key)
+        except Exception as e:
+            print(f"Background cache refresh failed for '{key}': {e}")
+        finally:
+            self._release(lock_key, token)
+    
+    def _lock(self, lock_key: str, lock_ttl: int) -> Optional[str]:
+        token = uuid.uuid4().hex
+        try:
+            return token if self.redis_client.set(lock_key, token, nx=True, ex=lock_ttl) else None
+        except redis.RedisError:
+            return token  # no lock to be had, compute without it
+    
+    def _release(self, lock_key: str, token: str):
+        try:
+            self._unlock(keys=[lock_key], args=[token])
+        except redis.RedisError:
+            pass
+    
+    def clear_pattern(self, pattern: str, batch_size: int = 500) -> int:
+        """Delete all keys matching pattern (e.g. 'analytics*').
+        Walks the keyspace incrementally with SCAN - bulk-clear tooling only,
+        request paths should use invalidate_namespace()."""
+        if not self.redis_client:
             return 0
+        try:
+            deleted = 0
+            batch = []
+            for key in self.redis_client.scan_iter(match=pattern, count=batch_size):
+                batch.append(key)
+                if len(batch) >= batch_size:
+                    deleted += self.redis_client.unlink(*batch)
+                    batch = []
+            if batch:
+                deleted += self.redis_client.unlink(*batch)
+            if not deleted:
+                print(f"No keys found for pattern '{pattern}'")
+            return deleted
         except redis.RedisError as e:
             print(f"Redis error in clear_pattern: {e}")
             return 0
@@ -122,33 +493,146 @@ class CacheInvalidator:
     @staticmethod
     def invalidate_order_related():
         """Delete analytics cache when new order is created"""
-        cache.clear_pattern("analytics*")
+        cache.invalidate_namespace("analytics")
         print("Cache invalidated: analytics (order created)")
+    
+    @staticmethod
+    def invalidate_counts():
+        """Drop cached listing totals when documents are added or removed"""
+        cache.invalidate_namespace("counts")
+
+    @staticmethod
+    def invalidate_principals():
+        """Drop cached login lookups when a user is deleted or changes email"""
+        cache.invalidate_namespace("principals")
 
 # Rate limiting functionality
+#
+# Token bucket: `limit` tokens refilled evenly over `window` seconds, kept in
+# one hash per identifier and updated by a single script call (one round
+# trip, the TTL is always set with the write, no 2x bursts at window edges).
+# The script takes up to ARGV[3] tokens and at least 1: when a bucket is
+# clearly full and this process used up its last lease before it expired
+# (so requests arrive faster than one lease per LEASE_TTL), the limiter
+# pre-pays a small lease of tokens and serves the next few requests from
+# process memory without calling Redis. Tokens left in an expired lease are
+# given back (ARGV[4]) with the next call.
+_TOKEN_BUCKET_SCRIPT = """
+local capacity = tonumber(ARGV[1])
+local window_ms = tonumber(ARGV[2])
+local want = tonumber(ARGV[3])
+local refund = tonumber(ARGV[4] or 0)
+local t = redis.call('TIME')
+local now = tonumber(t[1]) * 1000 + math.floor(tonumber(t[2]) / 1000)
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1])
+local ts = tonumber(state[2])
+if tokens == nil then
+    tokens = capacity
+    ts = now
+end
+local rate = capacity / window_ms
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate + refund)
+local taken = 0
+if tokens >= 1 then
+    taken = math.min(want, math.floor(tokens))
+    tokens = tokens - taken
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate) + 1000)
+local retry_ms = 0
+if taken == 0 then
+    retry_ms = math.ceil((1 - tokens) / rate)
+end
+local full_ms = math.ceil((capacity - tokens) / rate)
+return {taken, math.floor(tokens), retry_ms, full_ms}
+"""
+
+class RateLimitResult:
+    __slots__ = ("allowed", "limit", "remaining", "reset_after", "retry_after")
+
+    def __init__(self, allowed, limit, remaining, reset_after, retry_after=0):
+        self.allowed = allowed
+        self.limit = limit
+        self.remaining = remaining
+        self.reset_after = reset_after    # s until the bucket is full again
+        self.retry_after = retry_after    # s until the next token (when denied)
+
+    def headers(self) -> dict:
+        h = {
+            "RateLimit-Limit": str(self.limit),
+            "RateLimit-Remaining": str(max(0, self.remaining)),
+            "RateLimit-Reset": str(int(self.reset_after + 0.999)),
+        }
+        if not self.allowed:
+            h["Retry-After"] = str(max(1, int(self.retry_after + 0.999)))
+        return h
+
 class RateLimiter:
     """Request rate limiting class"""
+
+    LEASE_MAX = 10          # tokens pre-paid per Redis call at most
+    LEASE_TTL = 1.0         # s a lease may be used
     
     def __init__(self, cache_instance: RedisCache):
         self.cache = cache_instance
+        self._script = None
+        self._leases = {}   # key -> [tokens left, expires, last remaining, reset at, taken]
+        self._lock = threading.Lock()
+
+    def _take_lease(self, key, limit):
+        with self._lock:
+            lease = self._leases.get(key)
+            if not lease:
+                return None
+            now = time.monotonic()
+            if lease[0] <= 0 or lease[1] < now:
+                return None  # kept: hit() sizes the next lease from it
+            lease[0] -= 1
+            return RateLimitResult(True, limit, lease[2] + lease[0], max(0.0, lease[3] - now))
+
+    def hit(self, identifier: str, limit: int, window: int) -> RateLimitResult:
+        """Take one token for identifier; allows everything when Redis is down"""
+        key = f"rate_limit:{identifier}"
+        leased = self._take_lease(key, limit)
+        if leased:
+            return leased
+        if not self.cache.redis_client:
+            return RateLimitResult(True, limit, limit, 0)
+        with self._lock:
+            last = self._leases.pop(key, None)
+        now = time.monotonic()
+        # Whatever is left here expired unused (_take_lease serves live ones)
+        refund = max(0, last[0]) if last else 0
+        # Pre-pay a lease only when the last one ran out in time and the
+        # bucket is clearly full (over half left); double it while that holds
+        want = 1
+        if last and last[0] <= 0 and last[1] >= now and last[2] > limit // 2:
+            want = min(self.LEASE_MAX, last[4] * 2)
+        try:
+            if self._script is None or self._script.registered_client is not self.cache.redis_client:
+                self._script = self.cache.redis_client.register_script(_TOKEN_BUCKET_SCRIPT)
+            taken, remaining, retry_ms, full_ms = self._script(keys=[key], args=[limit, window * 1000, want, refund])
+        except redis.RedisError as e:
+            print(f"Redis error in rate limiter: {e}")
+            return RateLimitResult(True, limit, limit, 0)
+        taken, remaining = int(taken), int(remaining)
+        if taken == 0:
+            return RateLimitResult(False, limit, 0, full_ms / 1000, retry_ms / 1000)
+        now = time.monotonic()
+        with self._lock:
+            if len(self._leases) > 10000:
+                self._leases.clear()
+            self._leases[key] = [taken - 1, now + self.LEASE_TTL, remaining, now + full_ms / 1000, taken]
+        return RateLimitResult(True, limit, remaining + taken - 1, full_ms / 1000)
     
     def is_allowed(self, identifier: str, limit: int, window: int) -> bool:
         """Check if request is allowed according to rate limit"""
-        if not self.cache.redis_client:
-            return True  # If no Redis - allow all requests
-            
-        key = f"rate_limit:{identifier}"
-        current = self.cache.increment(key)
-        
-        if current == 1:
-            # First request - set expiration time
-            self.cache.redis_client.expire(key, window)
-            return True
-        
-        return current <= limit
+        return self.hit(identifier, limit, window).allowed
     
     def get_remaining(self, identifier: str, limit: int) -> int:
-        """Return remaining requests count in current window"""
-        key = f"rate_limit:{identifier}"
-        current = self.cache.get(key) or 0
-        return max(0, limit - int(current))
\ No newline at end of file
+        """Return remaining requests count (as of the last check in this process)"""
+        lease = self._leases.get(f"rate_limit:{identifier}")
+        return lease[2] + lease[0] if lease else limit
+
+rate_limiter = RateLimiter(cache)
@@ -2,95 +2,58 @@ from flask import Blueprint, jsonify
 from .utils import parse_int
 from redis_cache import cache
 
-analytics = Blueprint('analytics', __name__)
+ANALYTICS_TTL = 300        # 5 min
+ANALYTICS_STALE_TTL = 60   # served stale this long while one worker refreshes
 
 def init_analytics(db):
     """Initialize analytics routes with database connection"""
+    analytics = Blueprint('analytics', __name__)
     
     @analytics.get("/analytics/top-events")
     def top_events():
         limit = parse_int("limit", 10, 1, 100)
-        cache_key = f"analytics_top_events:{limit}"
-        
-        # Pabandyti gauti iš cache
-        cached = cache.get(cache_key)
-        if cached is not None:
-            print(f"Cache HIT: analytics_top_events")
-            return jsonify(cached)
-        
-        # Brangi agregacija
-        pipeline = [
-            {"$match": {"status": "paid"}},
-            {"$unwind": "$items"},
-            {"$group": {"_id": "$items.ticketId", "revenue": {"$sum": "$items.price"}}},
-            {"$lookup": {"from": "tickets", "localField": "_id", "foreignField": "_id", "as": "t"}},
-            {"$unwind": "$t"},
-            {"$group": {"_id": "$t.eventId", "revenue": {"$sum": "$revenue"}, "ticketsSold": {"$sum": 1}}},
-            {"$lookup": {"from": "events", "localField": "_id", "foreignField": "_id", "as": "event"}},
-            {"$unwind": "$event"},
-            {"$project": {
-                "_id": 0,
-                "eventId": {"$toString": "$_id"},
-                "title": "$event.title",
-                "eventDate": "$event.eventDate",
-                "revenue": 1,
-                "ticketsSold": 1
-            }},
-            {"$sort": {"revenue": -1}},
-            {"$limit": limit}
-        ]
-        result = list(db.orders.aggregate(pipeline))
-        
-        # Cache'inti rezultatą
-        cache.set(cache_key, result, 300)  # 5 min TTL
-        print(f"Cache SAVE: analytics_top_events (TTL: 300s)")
-        
+        cache_key = f"top_events:{limit}"
+        
+        def compute():
+            # Skaityti iš event_stats rollup (palaikomas su $inc apmokant užsakymus)
+            print(f"Cache MISS: analytics_top_events - recomputing")
+            cursor = db.event_stats.find(
+                {"ticketsSold": {"$gt": 0}},
+                {"title": 1, "eventDate": 1, "revenue": 1, "ticketsSold": 1}
+            ).sort("revenue", -1).limit(limit)
+            return [{
+                "eventId": str(d["_id"]),
+                "title": d.get("title"),
+                "eventDate": d.get("eventDate"),
+                "revenue": d.get("revenue", 0),
+                "ticketsSold": d.get("ticketsSold", 0)
+            } for d in cursor]
+        
+        # Single-flight: tik vienas worker'is perskaičiuoja, kiti laukia arba gauna seną reikšmę
+        result = cache.get_or_compute(cache_key, compute, ANALYTICS_TTL,
+                                      namespace="analytics", stale_ttl=ANALYTICS_STALE_TTL)
         return jsonify(result)
 
     @analytics.get("/analytics/availability")
     def availability():
-        cache_key = "analytics_availability"
-        
-        # Pabandyti gauti iš cache
-        cached = cache.get(cache_key)
-        if cached is not None:
-            print(f"Cache HIT: analytics_availability")
-            return jsonify(cached)
-        
-        # Brangi agregacija
-        pipeline = [
-            {"$match": {"status": "paid"}},
-            {"$unwind": "$items"},
-            {"$lookup": {
-                "from": "tickets",
-                "localField": "items.ticketId",
-                "foreignField": "_id",
-                "as": "t"
-            }},
-            {"$unwind": "$t"},
-            {"$group": {"_id": "$t.eventId", "sold": {"$sum": 1}}},
-            {"$lookup": {
-                "from": "tickets",
-                "let": {"ev": "$_id"},
-                "pipeline": [
-                    {"$match": {"$expr": {"$eq": ["$eventId", "$$ev"]}}},
-                    {"$count": "total"}
-                ],
-                "as": "totals"
-            }},
-            {"$addFields": {"total": {"$ifNull": [{"$first": "$totals.total"}, 0]}}},
-            {"$project": {"totals": 0}},
-            {"$addFields": {"available": {"$subtract": ["$total", "$sold"]}}},
-            {"$sort": {"available": -1}}
-        ]
-        data = list(db.orders.aggregate(pipeline))
-        for d in data:
-            d["eventId"] = str(d.pop("_id"))
-        
-        # Cache'inti rezultatą
-        cache.set(cache_key, data, 300)  # 5 min TTL
-        print(f"Cache SAVE: analytics_availability (TTL: 300s)")
-        
+        cache_key = "availability"
+        
+        def compute():
+            # Skaityti iš event_stats rollup
+            print(f"Cache MISS: analytics_availability - recomputing")
+            cursor = db.event_stats.find(
+                {"ticketsSold": {"$gt": 0}},
+                {"ticketsSold": 1, "total": 1, "available": 1}
+            ).sort("available", -1)
+            return [{
+                "eventId": str(d["_id"]),
+                "sold": d.get("ticketsSold", 0),
+                "total": d.get("total", 0),
+                "available": d.get("available", 0)
+            } for d in cursor]
+        
+        data = cache.get_or_compute(cache_key, compute, ANALYTICS_TTL,
+                                    namespace="analytics", stale_ttl=ANALYTICS_STALE_TTL)
         return jsonify(data)
     
     return analytics
@@ -1,10 +1,11 @@
 from flask import Blueprint, request, jsonify, session, redirect
 from .utils import login_required, organizer_required
-
-auth = Blueprint('auth', __name__)
+from .principals import PrincipalLookup
 
 def init_auth(app, db):
     """Initialize auth routes with database connection"""
+    auth = Blueprint('auth', __name__)
+    principals = PrincipalLookup(db)
     
     @auth.get("/login")
     def login_page():
@@ -19,19 +20,14 @@ def init_auth(app, db):
         if not email:
             return jsonify({"error": "email required"}), 400
 
-        user = db.users.find_one({"email": email})
-        user_type = 'user'
-        if not user:
-            org = db.organizers.find_one({"email": email}) if 'organizers' in db.list_collection_names() else None
-            if not org:
-                return jsonify({"error": "email not found"}), 404
-            user = org
-            user_type = 'organizer'
+        principal = principals.resolve(email)
+        if not principal:
+            return jsonify({"error": "email not found"}), 404
 
-        session['user_id'] = str(user['_id'])
-        session['user_type'] = user_type
+        session['user_id'] = principal["id"]
+        session['user_type'] = principal["type"]
         session.modified = True
-        return jsonify({"ok": True, "userId": session['user_id'], "userType": user_type})
+        return jsonify({"ok": True, "userId": session['user_id'], "userType": principal["type"]})
 
     @auth.post("/auth/logout")
     def auth_logout():
@@ -1,11 +1,14 @@
 from flask import Blueprint, request, jsonify, session
-from .utils import oid, login_required
+from .utils import oid, login_required, rate_limit
+from .inventory import (
+    hold_tickets, touch_cart, release_holds, group_by_event, take_ga,
+    CART_TTL, UNAVAILABLE_STATUSES
+)
 from redis_cache import cache, CacheInvalidator
 
-cart = Blueprint('cart', __name__)
-
 def init_cart(app, db, create_order_internal_fn):
     """Initialize cart routes with database connection and order function"""
+    cart = Blueprint('cart', __name__)
     
     @cart.get("/cart")
     @login_required
@@ -46,6 +49,7 @@ def init_cart(app, db, create_order_internal_fn):
 
     @cart.post("/cart/items")
     @login_required
+    @rate_limit("cart_items", "30/60")
     def add_to_cart():
         user_id = session.get('user_id')
         cart_key = f"cart:{user_id}"
@@ -59,47 +63,22 @@ def init_cart(app, db, create_order_internal_fn):
                 return jsonify({"error": "eventId required for GA"}), 400
             if qty < 1:
                 return jsonify({"error": "quantity must be >=1"}), 400
-            reserved_ticket_ids = set()
-            for o in db.orders.find({"status": {"$in": ["paid", "pending"]}}, {"items.ticketId": 1}):
-                for it in o.get("items", []):
-                    tidx = it.get("ticketId")
-                    if tidx:
-                        reserved_ticket_ids.add(tidx)
-            ga_tickets = list(db.tickets.find({
-                "eventId": event_id,
-                "$or": [
-                    {"isGeneralAdmission": True},
-                    {"type": {"$regex": r"^GA$", "$options": "i"}},
-                    {"seat": {"$regex": r"^GA$", "$options": "i"}},
-                ]
-            }, {"_id":1}))
-            available_ga = [t for t in ga_tickets if t['_id'] not in reserved_ticket_ids]
-            if len(available_ga) < qty:
-                return jsonify({"error": "not enough GA available", "available": len(available_ga)}), 409
-            
-            # Redis Set: pridėti GA bilietus
-            added = 0
-            for t in available_ga:
-                sid = str(t['_id'])
-                if not cache.redis_client.sismember(cart_key, sid):
-                    cache.redis_client.sadd(cart_key, sid)
-                    cache.redis_client.expire(cart_key, 900)  # 15 min TTL
-                    added += 1
-                if added >= qty:
-                    break
+            if not cache.redis_client:
+                return jsonify({"error": "cart unavailable"}), 503
+            # One atomic round trip: take qty GA tickets from the event pool into the cart
+            taken, available = take_ga(db, event_id, qty, cart_key=cart_key)
+            if taken is None:
+                return jsonify({"error": "not enough GA available", "available": available}), 409
+            touch_cart(db, cart_key, CART_TTL)  # holds of other events in the cart
             return get_cart()
         
         tid = oid(raw_tid)
         if not tid:
             return jsonify({"error": "invalid ticketId"}), 400
-        t = db.tickets.find_one({"_id": tid}, {"_id":1})
+        t = db.tickets.find_one({"_id": tid}, {"_id":1, "eventId":1, "status":1})
         if not t:
             return jsonify({"error": "ticket not found"}), 404
-        conflict = db.orders.find_one({
-            "status": {"$in": ["paid", "pending"]},
-            "items.ticketId": tid
-        }, {"_id":1})
-        if conflict:
+        if t.get("status") in UNAVAILABLE_STATUSES:
             return jsonify({"error": "ticket already reserved/sold"}), 409
         
         # Redis Set: pridėti bilietą
@@ -108,7 +87,9 @@ def init_cart(app, db, create_order_internal_fn):
             return jsonify({"ok": True, "message": "already in cart"})
         
         cache.redis_client.sadd(cart_key, tid_str)
-        cache.redis_client.expire(cart_key, 900)  # 15 min TTL
+        hold_tickets(t.get("eventId"), [tid])
+        # 15 min TTL for the cart and, with it, every hold already in it
+        touch_cart(db, cart_key, CART_TTL)
         return get_cart()
 
     @cart.delete("/cart/items/<ticket_id>")
@@ -119,6 +100,8 @@ def init_cart(app, db, create_order_internal_fn):
         
         # Redis Set: ištrinti bilietą
         removed = cache.redis_client.srem(cart_key, ticket_id) if cache.redis_client else 0
+        if removed and oid(ticket_id):
+            release_holds(group_by_event(db, [oid(ticket_id)]), restock=True)
         return jsonify({"removed": bool(removed)})
 
     @cart.post("/cart/clear")
@@ -127,15 +110,18 @@ def init_cart(app, db, create_order_internal_fn):
         user_id = session.get('user_id')
         cart_key = f"cart:{user_id}"
         
-        # Redis Hash: ištrinti visą krepšelį
-        cache.redis_client.delete(cart_key) if cache.redis_client else None
+        # Redis Set: ištrinti visą krepšelį
+        if cache.redis_client:
+            ticket_ids = [oid(t) for t in cache.redis_client.smembers(cart_key)]
+            cache.redis_client.delete(cart_key)
+            release_holds(group_by_event(db, [t for t in ticket_ids if t]), restock=True)
         return jsonify({"ok": True})
 
     @cart.post("/cart/checkout")
     @login_required
+    @rate_limit("checkout", "10/60")
     def cart_checkout():
         from .utils import serialize
-        from datetime import datetime, timezone
         
         user_id = session.get('user_id')
         cart_key = f"cart:{user_id}"
@@ -148,30 +134,21 @@ def init_cart(app, db, create_order_internal_fn):
         if not ticket_ids:
             return jsonify({"error": "cart is empty"}), 400
         
-        ok, result = create_order_internal_fn(user_id, ticket_ids)
+        # Order is written as paid, tickets claimed as sold - no follow-up update/re-read
+        ok, result = create_order_internal_fn(user_id, ticket_ids, paid=True)
         if not ok:
             return jsonify(result.get('body', {"error": "order_failed"})), result.get('status', 400)
-        
-        # Automatically mark order as paid
-        order_id = result['order']['_id']
-        now = datetime.now(timezone.utc)
-        db.orders.update_one(
-            {"_id": order_id},
-            {"$set": {
-                "status": "paid",
-                "payment.status": "paid",
-                "payment.paidAt": now
-            }}
-        )
-        
-        # Get updated order
-        paid_order = db.orders.find_one({"_id": order_id})
+        paid_order = result['order']
         
         # Invalidate analytics cache (order created and paid)
         CacheInvalidator.invalidate_order_related()
         
         # Redis Set: išvalyti krepšelį po sėkmingo užsakymo
         cache.redis_client.delete(cart_key) if cache.redis_client else None
+        holds = {}
+        for it in paid_order["items"]:
+            holds.setdefault(it["eventId"], []).append(it["ticketId"])
+        release_holds(holds)
         return jsonify({"ok": True, "order": serialize(paid_order)}), 201
 
     @cart.get('/ui/cart')
@@ -1,11 +1,78 @@
-from flask import Blueprint, jsonify, session
+from flask import Blueprint, jsonify, session, request, Response
 from datetime import datetime
 from redis_cache import cache
+import metrics
 
-debug = Blueprint('debug', __name__)
+MAX_SCAN_COUNT = 1000
+MAX_PREFIX_SCAN = 200_000
+TTL_BUCKETS = ((60, "<1m"), (300, "<5m"), (900, "<15m"), (3600, "<1h"), (86400, "<1d"))
+
+def _describe_keys(r, keys):
+    """type, ttl and memory of a batch of keys in one pipelined round trip"""
+    if not keys:
+        return []
+    pipe = r.pipeline(transaction=False)
+    for k in keys:
+        pipe.type(k)
+        pipe.ttl(k)
+        pipe.memory_usage(k)
+    res = pipe.execute(raise_on_error=False)
+    out = []
+    for i, k in enumerate(keys):
+        type_, ttl, size = res[3 * i:3 * i + 3]
+        out.append({
+            "key": k,
+            "type": None if isinstance(type_, Exception) else type_,
+            "ttl_seconds": ttl if isinstance(ttl, int) and ttl >= 0 else None,
+            "persistent": ttl == -1,
+            "bytes": size if isinstance(size, int) else None,  # MEMORY may be disabled (managed Redis)
+        })
+    return out
+
+def _prefix(key):
+    """cart:<user> -> cart, analytics:<gen>:top_events:10 -> analytics"""
+    return key.split(":", 1)[0] if ":" in key else key
+
+def _ttl_bucket(info):
+    if info["persistent"]:
+        return "persistent"
+    ttl = info["ttl_seconds"]
+    if ttl is None:
+        return "expired"
+    for bound, name in TTL_BUCKETS:
+        if ttl < bound:
+            return name
+    return ">=1d"
+
+def _prefix_stats(r, cursor, match, count, max_keys):
+    """Aggregate up to max_keys keys by prefix; returns a cursor to continue"""
+    prefixes = {}
+    scanned = 0
+    while True:
+        cursor, keys = r.scan(cursor=cursor, match=match, count=count)
+        for info in _describe_keys(r, keys):
+            p = prefixes.setdefault(_prefix(info["key"]), {"keys": 0, "bytes": 0, "bytes_unknown": 0, "types": {}, "ttl": {}})
+            p["keys"] += 1
+            if info["bytes"] is None:
+                p["bytes_unknown"] += 1
+            else:
+                p["bytes"] += info["bytes"]
+            p["types"][info["type"]] = p["types"].get(info["type"], 0) + 1
+            bucket = _ttl_bucket(info)
+            p["ttl"][bucket] = p["ttl"].get(bucket, 0) + 1
+        scanned += len(keys)
+        if cursor == 0 or scanned >= max_keys:
+            break
+    return {
+        "prefixes": dict(sorted(prefixes.items(), key=lambda kv: -kv[1]["keys"])),
+        "scanned_keys": scanned,
+        "cursor": cursor,
+        "complete": cursor == 0,
+    }
 
 def init_debug():
     """Initialize debug routes"""
+    debug = Blueprint('debug', __name__)
     
     @debug.get("/cache/status")
     def cache_status():
@@ -34,7 +101,8 @@ def init_debug():
                 "redis_info": {
                     "url": "redis-cloud",
                     "connected": True
-                }
+                },
+                "local_cache": cache.local.stats() if cache.local else None
             })
         except Exception as e:
             return jsonify({
@@ -42,55 +110,53 @@ def init_debug():
                 "error": str(e)
             }), 500
 
+    @debug.get("/debug/metrics")
+    def debug_metrics():
+        """Per-endpoint Mongo/Redis round trips and timings (Prometheus format)"""
+        return Response(metrics.render(), mimetype="text/plain; version=0.0.4")
+
     @debug.get("/debug/redis")
     def debug_redis():
-        """DEBUG: Rodo visus Redis keys (login optional - su login rodo cart info)"""
+        """DEBUG: Redis keyspace be KEYS * - SCAN puslapiai arba suvestinė pagal prefiksą
+        (login optional - su login rodo cart info)
+
+        ?cursor=0&count=200&match=cart:*   one SCAN page with type/ttl/bytes per key
+        ?view=prefixes&maxKeys=10000        per-prefix key count, memory, TTL buckets
+        """
         try:
-            # Visi Redis keys
-            all_keys = cache.redis_client.keys("*") if cache.redis_client else []
-            all_keys_str = [k.decode() if isinstance(k, bytes) else k for k in all_keys]
-            
-            # Keys su TTL info
-            keys_with_ttl = {}
-            for key in all_keys_str:
-                ttl = cache.redis_client.ttl(key)  # -1 = no expire, -2 = not exists
-                keys_with_ttl[key] = {
-                    "ttl_seconds": ttl if (ttl is not None and ttl >= 0) else None,
-                    "status": "persistent" if ttl == -1 else ("expired" if ttl == -2 else "temporary")
+            if not cache.redis_client:
+                return jsonify({"error": "redis unavailable"}), 503
+            r = cache.redis_client
+            match = request.args.get("match") or None
+            try:
+                cursor = int(request.args.get("cursor", 0))
+                count = min(max(int(request.args.get("count", 200)), 1), MAX_SCAN_COUNT)
+                max_keys = min(max(int(request.args.get("maxKeys", 10000)), 1), MAX_PREFIX_SCAN)
+            except ValueError:
+                return jsonify({"error": "cursor, count and maxKeys must be integers"}), 400
+
+            if request.args.get("view") == "prefixes":
+                result = _prefix_stats(r, cursor, match, count, max_keys)
+            else:
+                cursor, keys = r.scan(cursor=cursor, match=match, count=count)
+                result = {
+                    "cursor": cursor,
+                    "done": cursor == 0,
+                    "keys": _describe_keys(r, keys),
                 }
             
-            # Cache keys (analytics)
-            analytics_keys = [k for k in all_keys_str if 'analytics' in k]
-            cache_values = {}
-            for key in analytics_keys:
-                val = cache.get(key)
-                ttl = cache.redis_client.ttl(key)
-                if val:
-                    cache_values[key] = {
-                        "ttl_seconds": ttl if (ttl is not None and ttl >= 0) else None
-                    }
-            
-            result = {
-                "all_redis_keys": all_keys_str,
-                "total_keys": len(all_keys_str),
-                "keys_with_ttl": keys_with_ttl,
-                "analytics_cache": cache_values
-            }
-            
             # Optional: jei prisijungęs, rodyti cart info
             user_id = session.get('user_id')
             if user_id:
                 cart_key = f"cart:{user_id}"
-                cart_items = []
-                cart_ttl = None
-                if cache.redis_client and cache.redis_client.exists(cart_key):
-                    # Redis Set - gauti visus narius
-                    cart_members = cache.redis_client.smembers(cart_key)
-                    cart_items = [
-                        (m.decode() if isinstance(m, bytes) else m) 
-                        for m in cart_members
-                    ]
-                    cart_ttl = cache.redis_client.ttl(cart_key)
+                pipe = cache.redis_client.pipeline(transaction=False)
+                pipe.smembers(cart_key)
+                pipe.ttl(cart_key)
+                cart_members, cart_ttl = pipe.execute()
+                cart_items = [
+                    (m.decode() if isinstance(m, bytes) else m) 
+                    for m in cart_members
+                ]
                 result.update({
                     "user_id": user_id,
                     "cart_key": cart_key,
@@ -1,18 +1,21 @@
 from flask import Blueprint, request, jsonify, session, redirect
 from datetime import datetime
-from bson.int64 import Int64
-from .utils import oid, serialize, parse_int, organizer_required
+from .utils import oid, serialize, paginate, organizer_required
+from .stats import record_event_created
+from .seatmap import (parse_seat_map, count_tickets, start_generation, generation_state,
+                      SeatMapError, DEFAULT_SEAT_MAP)
+from .search import search_fields, apply_search, relevance_page, wants_relevance
 from redis_cache import CacheInvalidator
 
-events = Blueprint('events', __name__)
-
-def init_events(app, db):
-    """Initialize event routes with database connection"""
+def init_events(app, db, read_db=None):
+    """Initialize event routes with database connection (catalog reads use read_db)"""
+    read_db = read_db or db
+    events = Blueprint('events', __name__)
     
     @events.get("/venues")
     def list_venues():
         try:
-            venues = list(db.venues.find())
+            venues = list(read_db.venues.find())
             return jsonify({"data": [serialize(v) for v in venues]})
         except Exception as e:
             return jsonify({"error": "Failed to load venues"}), 500
@@ -56,51 +59,30 @@ def init_events(app, db):
         
         if description:
             event["description"] = description
+        event.update(search_fields(title))
         
+        try:
+            seat_map = parse_seat_map(data.get("seatMap") or DEFAULT_SEAT_MAP)
+        except SeatMapError as e:
+            return jsonify({"error": f"invalid seatMap: {e}"}), 400
+        total = count_tickets(seat_map)
+        event["seatMap"] = seat_map
+        event["ticketGeneration"] = {"status": "pending", "generated": 0, "total": total}
+
         try:
             result = db.events.insert_one(event)
-            created_event = db.events.find_one({"_id": result.inserted_id})
         except Exception as e:
             return jsonify({"error": "Failed to create event"}), 500
+        record_event_created(db, event, 0)
 
-        # Automatically create tickets for the event
-        try:
-            ticket_docs = []
-            
-            # 1. Create 100 GA (General Admission) tickets
-            ga_price = Int64(2500)  # 25.00 EUR
-            for _ in range(100):
-                ticket_docs.append({
-                    "eventId": result.inserted_id,
-                    "type": "GA",
-                    "seat": None,
-                    "price": ga_price,
-                })
-            
-            # 2. Create 100 Seated tickets (numbered A1-A50, B1-B50)
-            seated_price = Int64(3500)  # 35.00 EUR
-            rows = ['A', 'B']
-            seats_per_row = 50
-            
-            for row in rows:
-                for seat_num in range(1, seats_per_row + 1):
-                    ticket_docs.append({
-                        "eventId": result.inserted_id,
-                        "type": "seat",
-                        "seat": f"{row}{seat_num}",
-                        "price": seated_price,
-                    })
-            
-            # Insert all tickets at once
-            if ticket_docs:
-                db.tickets.insert_many(ticket_docs)
-                print(f"Created {len(ticket_docs)} tickets for event {result.inserted_id}")
-        except Exception as ticket_err:
-            print(f"Error creating tickets: {ticket_err}")
-            pass
+        # Tickets are generated from the seat map in batches (in the background
+        # for big maps); progress is kept in event.ticketGeneration
+        start_generation(db, result.inserted_id, total)
+        created_event = db.events.find_one({"_id": result.inserted_id})
 
         # Invalidate analytics cache - new event affects availability stats
         CacheInvalidator.invalidate_order_related()
+        CacheInvalidator.invalidate_counts()
 
         return jsonify(serialize(created_event)), 201
 
@@ -135,19 +117,19 @@ def init_events(app, db):
             if date_to:
                 q["eventDate"]["$lte"] = datetime.fromisoformat(date_to)
 
-        if v := request.args.get("q"):
-            q["title"] = {"$regex": v, "$options": "i"}
+        tokens = apply_search(q, request.args.get("q"))
 
         sort_field = request.args.get("sort", "eventDate")
         dir_ = 1 if request.args.get("dir", "asc") == "asc" else -1
-        page = parse_int("page", 1, 1, 1_000_000)
-        limit = parse_int("limit", 20, 1, 200)
-        skip = (page - 1) * limit
 
-        total = db.events.count_documents(q)
-        cursor = db.events.find(q).sort(sort_field, dir_).skip(skip).limit(limit)
-        data = [serialize(d) for d in cursor]
-        return jsonify({"data": data, "meta": {"page": page, "limit": limit, "total": total}})
+        if tokens and wants_relevance():
+            docs, meta = relevance_page(read_db.events, q, tokens, sort_field, dir_)
+        else:
+            docs, meta = paginate(read_db.events, q, sort_field, dir_)
+        if docs is None:
+            return jsonify(meta), 400
+        data = [serialize(d) for d in docs]
+        return jsonify({"data": data, "meta": meta})
 
     @events.get("/events/<event_id>")
     def get_event(event_id):
@@ -155,10 +137,41 @@ def init_events(app, db):
         if not _id:
             return jsonify({"error": "invalid event ID"}), 400
         
-        event = db.events.find_one({"_id": _id})
+        event = read_db.events.find_one({"_id": _id})
         if not event:
             return jsonify({"error": "event not found"}), 404
         
         return jsonify(serialize(event))
+
+    @events.get("/events/<event_id>/tickets/generation")
+    def ticket_generation(event_id):
+        _id = oid(event_id)
+        if not _id:
+            return jsonify({"error": "invalid event ID"}), 400
+        event = db.events.find_one({"_id": _id}, {"ticketGeneration": 1})
+        if not event:
+            return jsonify({"error": "event not found"}), 404
+        return jsonify(generation_state(event.get("ticketGeneration")) or {"status": "done"})
+
+    @events.post("/events/<event_id>/tickets/generation/resume")
+    @organizer_required
+    def resume_ticket_generation(event_id):
+        """Continue a failed (or stalled) generation from its last batch"""
+        _id = oid(event_id)
+        if not _id:
+            return jsonify({"error": "invalid event ID"}), 400
+        event = db.events.find_one({"_id": _id}, {"organizerId": 1, "ticketGeneration": 1})
+        if not event:
+            return jsonify({"error": "event not found"}), 404
+        if event.get("organizerId") != oid(session.get('user_id')):
+            return jsonify({"error": "not your event"}), 403
+        progress = event.get("ticketGeneration")
+        if not progress or progress.get("status") == "done":
+            return jsonify({"error": "ticket generation already finished"}), 409
+
+        start_generation(db, _id, progress.get("total", 0) - progress.get("generated", 0))
+        CacheInvalidator.invalidate_order_related()
+        event = db.events.find_one({"_id": _id}, {"ticketGeneration": 1})
+        return jsonify(generation_state(event.get("ticketGeneration"))), 202
     
     return events
@@ -0,0 +1,105 @@
+import os
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+from bson import ObjectId
+from pymongo import UpdateMany
+from .inventory import restock_ga, notify_availability, order_event_ids, group_by_event, TICKET_AVAILABLE
+
+# Pending-order expiry. A pending order holds its tickets (status
+# "reserved") only until expiresAt (ORDER_PENDING_TTL seconds after it was
+# placed). The sweeper cancels expired pending orders in batches, releases
+# their tickets and returns GA tickets to the pool, so stuck inventory goes
+# back on sale. Uses the partial index on orders.expiresAt (status pending).
+# Only interactive checkout orders get expiresAt; box-office / partner batch
+# orders (POST /orders/batch) stay pending until paid or canceled.
+
+PENDING_TTL = int(os.getenv("ORDER_PENDING_TTL", 900))   # s
+SWEEP_INTERVAL = int(os.getenv("ORDER_SWEEP_INTERVAL", 60))  # s
+SWEEP_BATCH = int(os.getenv("ORDER_SWEEP_BATCH", 500))
+
+def pending_expiry(now=None):
+    return (now or datetime.now(timezone.utc)) + timedelta(seconds=PENDING_TTL)
+
+def expired_filter(now):
+    """Pending orders past expiresAt (partial index on orders.expiresAt)"""
+    return {"status": "pending", "expiresAt": {"$lte": now}}
+
+def _expire_batch(db, now, batch_size):
+    """Cancel up to batch_size expired pending orders; returns
+    (candidates found, orders canceled)"""
+    ids = [o["_id"] for o in db.orders.find(
+        expired_filter(now), {"_id": 1}
+    ).sort("expiresAt", 1).limit(batch_size)]
+    if not ids:
+        return 0, 0
+    # Stamp the orders this sweep actually canceled: one paid or canceled
+    # in the meantime is left alone and its tickets are not touched
+    sweep_id = ObjectId()
+    db.orders.update_many(
+        {"_id": {"$in": ids}, **expired_filter(now)},
+        {"$set": {"status": "canceled", "cancelReason": "expired", "expiredBy": sweep_id,
+                  "payment.status": "failed", "payment.paidAt": None},
+         "$unset": {"expiresAt": ""}}
+    )
+    expired = list(db.orders.find({"_id": {"$in": ids}, "expiredBy": sweep_id}, {"items": 1}))
+    ops = []
+    released = []
+    for o in expired:
+        ticket_ids = [it["ticketId"] for it in o.get("items", [])]
+        ops.append(UpdateMany(
+            {"_id": {"$in": ticket_ids}, "orderId": o["_id"]},
+            {"$set": {"status": TICKET_AVAILABLE}, "$unset": {"orderId": ""}}
+        ))
+        released.extend(ticket_ids)
+    if ops:
+        db.tickets.bulk_write(ops, ordered=False)
+    for event_id, ticket_ids in group_by_event(db, released, ga_only=True).items():
+        restock_ga(event_id, ticket_ids)
+    notify_availability({e for o in expired for e in order_event_ids(o)})
+    return len(ids), len(expired)
+
+def expire_pending_orders(db, batch_size=SWEEP_BATCH, max_batches=None, now=None):
+    """Cancel all pending orders past expiresAt, batch by batch; returns the count"""
+    now = now or datetime.now(timezone.utc)
+    total = 0
+    batches = 0
+    while max_batches is None or batches < max_batches:
+        found, expired = _expire_batch(db, now, batch_size)
+        batches += 1
+        total += expired
+        if found < batch_size:
+            break
+    if total:
+        from redis_cache import CacheInvalidator
+        CacheInvalidator.invalidate_order_related()
+    return total
+
+def backfill_expiry(db):
+    """Give pending orders created before expiry existed an expiresAt
+    (orderDate + ORDER_PENDING_TTL); batch orders are left alone"""
+    res = db.orders.update_many(
+        {"status": "pending", "expiresAt": {"$exists": False}, "source": {"$ne": "batch"}},
+        [{"$set": {"expiresAt": {"$add": ["$orderDate", PENDING_TTL * 1000]}}}]
+    )
+    return res.modified_count
+
+def start_sweeper(db, interval=SWEEP_INTERVAL):
+    """Background thread sweeping every `interval` s. Each round is guarded
+    by a Redis lock, so across all workers only one sweeps per interval."""
+    def run():
+        from redis_cache import cache
+        while True:
+            time.sleep(interval)
+            try:
+                r = cache.redis_client
+                if r and not r.set("sweeper:orders", os.getpid(), nx=True, ex=interval):
+                    continue
+                n = expire_pending_orders(db)
+                if n:
+                    print(f"Expired {n} pending orders")
+            except Exception as e:
+                print(f"Order sweep failed: {e}")
+    t = threading.Thread(target=run, name="order-sweeper", daemon=True)
+    t.start()
+    return t
@@ -0,0 +1,413 @@
+import time
+from pymongo import UpdateMany
+from redis_cache import cache
+from .utils import oid
+
+# Ticket status lifecycle, kept on each ticket document so availability
+# checks only read the tickets of one event instead of every order.
+TICKET_AVAILABLE = "available"
+TICKET_RESERVED = "reserved"   # held by a pending order
+TICKET_SOLD = "sold"           # held by a paid order
+
+UNAVAILABLE_STATUSES = [TICKET_RESERVED, TICKET_SOLD]
+
+def available_filter():
+    """Query fragment matching tickets that are not reserved or sold.
+    Tickets created before the status field existed count as available."""
+    return {"status": {"$nin": UNAVAILABLE_STATUSES}}
+
+def order_ticket_ids(order):
+    return [it["ticketId"] for it in (order or {}).get("items", []) if it.get("ticketId")]
+
+def claim_tickets(db, ticket_ids, order_id, status=TICKET_RESERVED, session=None):
+    """Atomically claim tickets for an order with one conditional update.
+    Each ticket flips only if it is still available, so concurrent claims on
+    the same seat cannot both win. On a partial claim everything this order
+    took is rolled back. Returns (claimed, conflicting ticket ids)."""
+    ticket_ids = list(ticket_ids)
+    if not ticket_ids:
+        return True, []
+    res = db.tickets.update_many(
+        {"_id": {"$in": ticket_ids}, **available_filter()},
+        {"$set": {"status": status, "orderId": order_id}},
+        session=session
+    )
+    if res.modified_count == len(ticket_ids):
+        return True, []
+    release_tickets(db, ticket_ids, order_id, session=session)
+    return False, [t["_id"] for t in db.tickets.find(
+        {"_id": {"$in": ticket_ids}, "status": {"$in": UNAVAILABLE_STATUSES}}, {"_id": 1},
+        session=session
+    )]
+
+def mark_sold(db, ticket_ids, order_id):
+    """Turn a paid order's reservation into a sale. Only tickets still owned
+    by that order are touched (as in release_tickets)."""
+    if not ticket_ids:
+        return 0
+    res = db.tickets.update_many(
+        {"_id": {"$in": list(ticket_ids)}, "orderId": order_id},
+        {"$set": {"status": TICKET_SOLD}}
+    )
+    return res.modified_count
+
+def release_tickets(db, ticket_ids, order_id, session=None):
+    """Return tickets of a canceled order to sale. Only tickets still owned
+    by that order are touched."""
+    if not ticket_ids:
+        return 0
+    res = db.tickets.update_many(
+        {"_id": {"$in": list(ticket_ids)}, "orderId": order_id},
+        {"$set": {"status": TICKET_AVAILABLE}, "$unset": {"orderId": ""}},
+        session=session
+    )
+    return res.modified_count
+
+def rebuild_ticket_status(db, batch_size=1000):
+    """Backfill ticket status from the orders collection (one full pass)."""
+    db.tickets.update_many(
+        {"status": {"$exists": True}},
+        {"$set": {"status": TICKET_AVAILABLE}, "$unset": {"orderId": ""}}
+    )
+    ops = []
+    updated = 0
+    cursor = db.orders.find({"status": {"$in": ["paid", "pending"]}}, {"status": 1, "items.ticketId": 1})
+    for o in cursor:
+        status = TICKET_SOLD if o["status"] == "paid" else TICKET_RESERVED
+        ids = order_ticket_ids(o)
+        if not ids:
+            continue
+        ops.append(UpdateMany({"_id": {"$in": ids}}, {"$set": {"status": status, "orderId": o["_id"]}}))
+        if len(ops) >= batch_size:
+            updated += db.tickets.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        updated += db.tickets.bulk_write(ops, ordered=False).modified_count
+    return updated
+
+# Live availability: every mutation that can change what an event has on
+# sale publishes the event id on availability:<eventId>. Subscribers
+# (routes/live.py) recompute and push deltas; the message carries no data.
+def availability_channel(event_id):
+    return f"availability:{event_id}"
+
+def notify_availability(event_ids):
+    """Tell live availability streams that these events changed"""
+    event_ids = {e for e in event_ids if e}
+    if not cache.redis_client or not event_ids:
+        return
+    try:
+        pipe = cache.redis_client.pipeline(transaction=False)
+        for event_id in event_ids:
+            pipe.publish(availability_channel(event_id), "1")
+        pipe.execute()
+    except Exception as e:
+        print(f"Error publishing availability change: {e}")
+
+def order_event_ids(order):
+    return {it.get("eventId") for it in (order or {}).get("items", [])}
+
+# Cart holds: one sorted set per event (holds:<eventId>), member = ticket id,
+# score = hold expiry timestamp. Expired holds are dropped by score, so
+# availability is a single bounded read per event.
+CART_TTL = 900  # 15 min
+
+def holds_key(event_id):
+    return f"holds:{event_id}"
+
+def ga_holds_key(event_id):
+    return f"ga_holds:{event_id}"
+
+def hold_tickets(event_id, ticket_ids, ttl=CART_TTL):
+    if not cache.redis_client or not event_id or not ticket_ids:
+        return
+    key = holds_key(event_id)
+    expires = time.time() + ttl
+    try:
+        pipe = cache.redis_client.pipeline(transaction=False)
+        pipe.zadd(key, {str(t): expires for t in ticket_ids})
+        pipe.expire(key, ttl)  # whole index outlives the newest hold only
+        pipe.publish(availability_channel(event_id), "1")
+        pipe.execute()
+    except Exception as e:
+        print(f"Error writing cart holds: {e}")
+
+def touch_cart(db, cart_key, ttl=CART_TTL):
+    """Extend a cart and every hold of its tickets to one new deadline, so no
+    seat or GA ticket still in a live cart is treated as free. Holds that are
+    already gone are not recreated (ZADD XX)."""
+    r = cache.redis_client
+    if not r:
+        return
+    try:
+        members = [oid(m) for m in r.smembers(cart_key)]
+        expires = time.time() + ttl
+        pipe = r.pipeline(transaction=False)
+        for event_id, ticket_ids in group_by_event(db, [m for m in members if m]).items():
+            if not event_id:
+                continue
+            scores = {str(t): expires for t in ticket_ids}
+            for key in (holds_key(event_id), ga_holds_key(event_id)):
+                pipe.zadd(key, scores, xx=True)
+                pipe.expire(key, ttl)
+        pipe.expire(cart_key, ttl)
+        pipe.execute()
+    except Exception as e:
+        print(f"Error refreshing cart holds: {e}")
+
+def release_holds(holds_by_event, restock=False):
+    """Drop holds, given {eventId: [ticketId, ...]}. With restock=True held GA
+    tickets go back to the event's GA pool (cart removal / clear); without it
+    they are only forgotten (checkout - the tickets are sold)."""
+    if not cache.redis_client or not holds_by_event:
+        return
+    try:
+        pipe = cache.redis_client.pipeline(transaction=False)
+        for event_id, ticket_ids in holds_by_event.items():
+            if not ticket_ids:
+                continue
+            members = [str(t) for t in ticket_ids]
+            if restock:
+                _script("release")(
+                    keys=[holds_key(event_id), ga_holds_key(event_id), ga_pool_key(event_id), ga_ready_key(event_id)],
+                    args=[RESTOCK_HELD] + members,
+                    client=pipe
+                )
+            else:
+                pipe.zrem(holds_key(event_id), *members)
+                pipe.zrem(ga_holds_key(event_id), *members)
+            pipe.publish(availability_channel(event_id), "1")
+        pipe.execute()
+    except Exception as e:
+        print(f"Error releasing cart holds: {e}")
+
+def _queue_held(pipe, event_id):
+    now = time.time()
+    pipe.zremrangebyscore(holds_key(event_id), "-inf", now)
+    pipe.zrange(holds_key(event_id), 0, -1)
+    # Expired GA holds are left in place: the next GA take returns them to the pool
+    pipe.zrangebyscore(ga_holds_key(event_id), now, "+inf")
+
+def _parse_held(results):
+    _, members, ga_members = results
+    held = set()
+    for m in members + ga_members:
+        tid = oid(m.decode() if isinstance(m, bytes) else m)
+        if tid:
+            held.add(tid)
+    return held
+
+def held_ticket_ids(event_id):
+    """Ticket ids currently held in carts for one event"""
+    if not cache.redis_client:
+        return set()
+    try:
+        pipe = cache.redis_client.pipeline(transaction=False)
+        _queue_held(pipe, event_id)
+        return _parse_held(pipe.execute())
+    except Exception as e:
+        print(f"Error checking cart reservations: {e}")
+        return set()
+
+async def held_ticket_ids_async(redis_client, event_id):
+    """held_ticket_ids() on a redis.asyncio client"""
+    if not redis_client:
+        return set()
+    try:
+        pipe = redis_client.pipeline(transaction=False)
+        _queue_held(pipe, event_id)
+        return _parse_held(await pipe.execute())
+    except Exception as e:
+        print(f"Error checking cart reservations: {e}")
+        return set()
+
+def group_by_event(db, ticket_ids, ga_only=False):
+    """{eventId: [ticketId, ...]} for the given tickets; ga_only keeps only
+    the ones ga_filter() puts in the GA pool"""
+    grouped = {}
+    if not ticket_ids:
+        return grouped
+    q = {"_id": {"$in": list(ticket_ids)}}
+    if ga_only:
+        q.update(ga_filter())
+    for t in db.tickets.find(q, {"eventId": 1}):
+        grouped.setdefault(t.get("eventId"), []).append(t["_id"])
+    return grouped
+
+# GA pool: per-event Redis set of free GA ticket ids (ga_pool:<eventId>).
+# Taking N tickets is one SPOP inside a Lua script, which also records the
+# hold in ga_holds:<eventId> and returns expired holds to the pool first.
+# The pool is built lazily from Mongo; ga_pool:<eventId>:ready marks it built
+# (an empty set does not exist in Redis, so the set alone can't tell).
+RESTOCK_HELD = 1   # return tickets to the pool if they were held as GA
+RESTOCK_ALL = 2    # return all given tickets (caller knows they are GA)
+
+_LUA_CHUNK = """
+local function sadd_all(key, ids)
+  for i = 1, #ids, 1000 do
+    redis.call('SADD', key, unpack(ids, i, math.min(i + 999, #ids)))
+  end
+end
+"""
+
+_LUA = {
+    # KEYS: pool, ready, ga_holds[, cart]  ARGV: qty, now, hold_expiry, cart_ttl
+    # Returns -1 if the pool is not built, the free count if it is too small,
+    # otherwise the list of taken ticket ids.
+    "take": _LUA_CHUNK + """
+if redis.call('EXISTS', KEYS[2]) == 0 then return -1 end
+if #KEYS >= 4 then
+  -- the cart is extended below: its GA holds must not be reclaimed first
+  for _, id in ipairs(redis.call('SMEMBERS', KEYS[4])) do
+    redis.call('ZADD', KEYS[3], 'XX', ARGV[3], id)
+  end
+end
+local expired = redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', ARGV[2])
+if #expired > 0 then
+  redis.call('ZREMRANGEBYSCORE', KEYS[3], '-inf', ARGV[2])
+  sadd_all(KEYS[1], expired)
+end
+local n = tonumber(ARGV[1])
+local free = redis.call('SCARD', KEYS[1])
+if free < n then return free end
+local ids = redis.call('SPOP', KEYS[1], n)
+for _, id in ipairs(ids) do
+  redis.call('ZADD', KEYS[3], ARGV[3], id)
+end
+if #KEYS >= 4 then
+  sadd_all(KEYS[4], ids)
+  redis.call('EXPIRE', KEYS[4], ARGV[4])
+end
+return ids
+""",
+    # KEYS: holds, ga_holds, pool, ready  ARGV: mode, ticket ids...
+    "release": """
+local ready = redis.call('EXISTS', KEYS[4]) == 1
+local mode = tonumber(ARGV[1])
+local back = 0
+for i = 2, #ARGV do
+  redis.call('ZREM', KEYS[1], ARGV[i])
+  local was_ga = redis.call('ZREM', KEYS[2], ARGV[i])
+  if ready and (mode == 2 or (mode == 1 and was_ga == 1)) then
+    back = back + redis.call('SADD', KEYS[3], ARGV[i])
+  end
+end
+return back
+""",
+}
+_scripts = {}
+
+def _script(name):
+    script = _scripts.get(name)
+    if script is None or script.registered_client is not cache.redis_client:
+        _scripts[name] = cache.redis_client.register_script(_LUA[name])
+    return _scripts[name]
+
+def ga_pool_key(event_id):
+    return f"ga_pool:{event_id}"
+
+def ga_ready_key(event_id):
+    return f"ga_pool:{event_id}:ready"
+
+def ga_filter():
+    return {"$or": [
+        {"isGeneralAdmission": True},
+        {"type": {"$regex": r"^GA$", "$options": "i"}},
+        {"seat": {"$regex": r"^GA$", "$options": "i"}},
+    ]}
+
+def is_ga(ticket):
+    """Python twin of ga_filter() for a ticket document already in hand"""
+    return bool(ticket.get("isGeneralAdmission")
+                or str(ticket.get("type") or "").upper() == "GA"
+                or str(ticket.get("seat") or "").upper() == "GA")
+
+def remove_from_ga_pool(tickets):
+    """Take GA tickets claimed by id (not through take_ga) out of their
+    event's pool and GA holds, so the pool cannot hand them out again"""
+    if not cache.redis_client:
+        return
+    by_event = {}
+    for t in tickets:
+        if t.get("eventId") and is_ga(t):
+            by_event.setdefault(t["eventId"], []).append(str(t["_id"]))
+    if not by_event:
+        return
+    try:
+        pipe = cache.redis_client.pipeline(transaction=False)
+        for event_id, ids in by_event.items():
+            pipe.srem(ga_pool_key(event_id), *ids)
+            pipe.zrem(ga_holds_key(event_id), *ids)
+        pipe.execute()
+    except Exception as e:
+        print(f"Error updating GA pool: {e}")
+
+def _available_ga_ids(db, event_id, limit=0):
+    q = {"eventId": event_id, **ga_filter(), **available_filter()}
+    return [t["_id"] for t in db.tickets.find(q, {"_id": 1}).limit(limit)]
+
+def _build_ga_pool(db, event_id):
+    """Fill the GA pool from Mongo; only one worker builds at a time"""
+    r = cache.redis_client
+    lock = f"ga_pool:{event_id}:lock"
+    if not r.set(lock, "1", nx=True, ex=30):
+        return False
+    try:
+        held = {m for m in r.zrangebyscore(ga_holds_key(event_id), time.time(), "+inf")}
+        ids = [str(t) for t in _available_ga_ids(db, event_id) if str(t) not in held]
+        pipe = r.pipeline()
+        pipe.delete(ga_pool_key(event_id))
+        for i in range(0, len(ids), 1000):
+            pipe.sadd(ga_pool_key(event_id), *ids[i:i + 1000])
+        pipe.set(ga_ready_key(event_id), "1")
+        pipe.execute()
+        return True
+    finally:
+        r.delete(lock)
+
+def take_ga(db, event_id, qty, cart_key=None, ttl=CART_TTL):
+    """Atomically take qty free GA tickets of an event.
+    Returns (ticket_ids, available) - ticket_ids is None if not enough are free.
+    Taken tickets are held until released, sold, or the hold expires."""
+    if not cache.redis_client:
+        ids = _available_ga_ids(db, event_id)
+        return (ids[:qty] if len(ids) >= qty else None), len(ids)
+    keys = [ga_pool_key(event_id), ga_ready_key(event_id), ga_holds_key(event_id)]
+    if cart_key:
+        keys.append(cart_key)
+    now = time.time()
+    for _ in range(50):
+        res = _script("take")(keys=keys, args=[qty, now, now + ttl, ttl])
+        if isinstance(res, list):
+            ids = [oid(m.decode() if isinstance(m, bytes) else m) for m in res]
+            notify_availability([event_id])
+            return ids, len(ids)
+        if res >= 0:
+            return None, res
+        if not _build_ga_pool(db, event_id):
+            time.sleep(0.05)  # another worker is building the pool
+    return None, 0
+
+def restock_ga(event_id, ticket_ids):
+    """Return GA tickets (e.g. of a canceled order) to the pool"""
+    if not cache.redis_client or not ticket_ids:
+        return 0
+    try:
+        back = _script("release")(
+            keys=[holds_key(event_id), ga_holds_key(event_id), ga_pool_key(event_id), ga_ready_key(event_id)],
+            args=[RESTOCK_ALL] + [str(t) for t in ticket_ids]
+        )
+    except Exception as e:
+        print(f"Error restocking GA pool: {e}")
+        return 0
+    notify_availability([event_id])
+    return back
+
+def reset_ga_pools():
+    """Forget all GA pools; they are rebuilt from Mongo on next use"""
+    if not cache.redis_client:
+        return 0
+    deleted = 0
+    for key in cache.redis_client.scan_iter("ga_pool:*:ready", count=500):
+        deleted += cache.redis_client.delete(key)
+    return deleted
@@ -0,0 +1,228 @@
+import asyncio
+import json
+import os
+import queue
+import threading
+import time
+from flask import Blueprint, Response, jsonify
+from redis_cache import cache
+from .utils import oid, rate_limit
+from .inventory import held_ticket_ids
+from .tickets import ticket_query, ticket_listing
+
+# Live seat availability over server-sent events.
+#
+# One AvailabilityHub per process holds, for every event somebody is
+# watching, the current availability rows (same rows as GET /tickets) and
+# the viewers' queues. Cart, order, payment and expiry mutations publish on
+# availability:<eventId> (see inventory.notify_availability); the hub marks
+# the event dirty, recomputes it at most once per COALESCE seconds no matter
+# how many viewers or changes there are, diffs the rows and pushes only the
+# delta to every viewer. Cart holds also expire without any mutation, so
+# watched events are refreshed every REFRESH seconds as well.
+#
+# Under WSGI each open stream keeps a worker thread busy (threaded or gevent
+# workers); asgi.py serves the same stream natively, one coroutine per viewer
+# (LoopViewer) on this process's hub.
+#
+# Opening a stream is limited per logged-in user, not per IP: behind NAT or
+# carrier-grade NAT many viewers share an address, and EventSource reconnects
+# on its own after every dropped connection.
+
+COALESCE = float(os.getenv("AVAILABILITY_COALESCE", 0.5))  # s
+REFRESH = float(os.getenv("AVAILABILITY_REFRESH", 30))      # s
+KEEPALIVE = 15    # s between comment lines on an idle stream
+QUEUE_SIZE = 100  # deltas a slow viewer may lag behind before it is dropped
+
+_RESET = object()  # tells a dropped viewer's stream to end (the browser reconnects)
+
+class LoopViewer(queue.Queue):
+    """Viewer queue read by a coroutine: the hub's threads put into it as
+    into any viewer queue, and each put wakes get_async() on its loop"""
+
+    def __init__(self, loop):
+        super().__init__(maxsize=QUEUE_SIZE)
+        self._loop = loop
+        self._ready = asyncio.Event()
+
+    def _put(self, item):
+        super()._put(item)
+        try:
+            self._loop.call_soon_threadsafe(self._ready.set)
+        except RuntimeError:
+            pass  # loop closed, the stream is gone
+
+    async def get_async(self, timeout):
+        """Next item; raises queue.Empty after timeout s"""
+        while True:
+            try:
+                return self.get_nowait()
+            except queue.Empty:
+                pass
+            # _put sets the event through the loop, so it cannot be lost
+            # between the check above and this clear
+            self._ready.clear()
+            try:
+                await asyncio.wait_for(self._ready.wait(), timeout)
+            except asyncio.TimeoutError:
+                raise queue.Empty from None
+
+class _Watched:
+    __slots__ = ("rows", "version", "viewers", "dirty", "computed_at")
+
+    def __init__(self):
+        self.rows = None  # {row _id: row}
+        self.version = 0
+        self.viewers = set()
+        self.dirty = True
+        self.computed_at = 0.0
+
+class AvailabilityHub:
+    def __init__(self, db):
+        self.db = db
+        self._events = {}  # eventId -> _Watched
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._started_pid = None
+
+    def _start(self):
+        """Pub/sub listener and recompute loop, once per process"""
+        if self._started_pid == os.getpid():
+            return
+        self._started_pid = os.getpid()
+        self._events.clear()  # copied from the parent process
+        r = cache.redis_client
+        if r:
+            try:
+                pubsub = r.pubsub(ignore_subscribe_messages=True)
+                pubsub.psubscribe(**{"availability:*": self._on_change})
+                pubsub.run_in_thread(sleep_time=1, daemon=True)
+            except Exception as e:
+                print(f"Availability listener failed, falling back to refresh every {REFRESH}s: {e}")
+        threading.Thread(target=self._run, name="availability-hub", daemon=True).start()
+
+    def _on_change(self, message):
+        channel = message["channel"]
+        event_id = oid((channel.decode() if isinstance(channel, bytes) else channel).split(":", 1)[1])
+        with self._lock:
+            watched = self._events.get(event_id)
+            if watched is None:
+                return
+            watched.dirty = True
+        self._wake.set()
+
+    def _compute(self, event_id):
+        q, _ = ticket_query({}, event_id)
+        rows = ticket_listing(list(self.db.tickets.find(q)), held_ticket_ids(event_id))
+        return {str(r["_id"]): r for r in rows}
+
+    def _refresh(self, event_id, watched):
+        try:
+            rows = self._compute(event_id)
+        except Exception as e:
+            print(f"Availability refresh failed for {event_id}: {e}")
+            return
+        with self._lock:
+            old = watched.rows or {}
+            removed = [k for k in old if k not in rows]
+            upserted = [r for k, r in rows.items() if old.get(k) != r]
+            watched.rows = rows
+            watched.computed_at = time.time()
+            if not removed and not upserted:
+                return
+            watched.version += 1
+            delta = {"v": watched.version, "removed": removed, "upserted": upserted}
+            for q in list(watched.viewers):
+                try:
+                    q.put_nowait(delta)
+                except queue.Full:
+                    watched.viewers.discard(q)
+                    q.queue.clear()
+                    q.put_nowait(_RESET)
+
+    def _run(self):
+        while True:
+            self._wake.wait(timeout=REFRESH)
+            self._wake.clear()
+            time.sleep(COALESCE)  # let a burst of changes settle into one recompute
+            now = time.time()
+            with self._lock:
+                due = []
+                for event_id, watched in self._events.items():
+                    if watched.dirty or now - watched.computed_at >= REFRESH:
+                        watched.dirty = False
+                        due.append((event_id, watched))
+            for event_id, watched in due:
+                self._refresh(event_id, watched)
+
+    def subscribe(self, event_id, viewer=None):
+        """(viewer queue, snapshot {"v", "rows"}) - the snapshot is the
+        event's shared rows, computed here only for the first viewer"""
+        self._start()
+        if viewer is None:
+            viewer = queue.Queue(maxsize=QUEUE_SIZE)
+        with self._lock:
+            watched = self._events.setdefault(event_id, _Watched())
+            watched.viewers.add(viewer)
+            fresh = watched.rows is not None
+        if not fresh:
+            self._refresh(event_id, watched)
+        with self._lock:
+            snapshot = {"v": watched.version, "rows": list((watched.rows or {}).values())}
+        return viewer, snapshot
+
+    def unsubscribe(self, event_id, viewer):
+        with self._lock:
+            watched = self._events.get(event_id)
+            if watched is None:
+                return
+            watched.viewers.discard(viewer)
+            if not watched.viewers:
+                del self._events[event_id]
+
+def _sse(event, data, id=None):
+    head = f"id: {id}\n" if id is not None else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, separators=(',', ':'))}\n\n"
+
+def init_live(db):
+    """Live availability stream; db is the handle availability is read from.
+    The hub is kept as live.hub for the async stream in asgi.py"""
+    live = Blueprint('live', __name__)
+    hub = live.hub = AvailabilityHub(db)
+
+    @live.get("/events/<event_id>/availability/stream")
+    @rate_limit("availability_stream", "60/60")
+    def availability_stream(event_id):
+        """text/event-stream: one "snapshot" (all rows, as GET /tickets),
+        then a "delta" ({"v", "removed": [row ids], "upserted": [rows]})
+        per change. The GA row has _id "GA" and carries the free count."""
+        _event = oid(event_id)
+        if not _event:
+            return jsonify({"error": "invalid event id"}), 400
+        viewer, snapshot = hub.subscribe(_event)
+
+        def stream():
+            yield "retry: 3000\n\n"
+            yield _sse("snapshot", snapshot, snapshot["v"])
+            while True:
+                try:
+                    delta = viewer.get(timeout=KEEPALIVE)
+                except queue.Empty:
+                    yield ": keepalive\n\n"
+                    continue
+                if delta is _RESET:
+                    return
+                if delta["v"] <= snapshot["v"]:
+                    continue  # already part of the snapshot
+                yield _sse("delta", delta, delta["v"])
+
+        resp = Response(stream(), mimetype="text/event-stream", headers={
+            "Cache-Control": "no-cache",
+            "X-Accel-Buffering": "no",  # nginx: do not buffer the stream
+        })
+        # Runs when the server closes the response, also if the client left
+        # before the first chunk
+        resp.call_on_close(lambda: hub.unsubscribe(_event, viewer))
+        return resp
+
+    return live
@@ -1,70 +1,155 @@
+import os
 from flask import Blueprint, request, jsonify, session
+from bson import ObjectId
 from bson.int64 import Int64
+from pymongo import UpdateMany
+from pymongo.errors import BulkWriteError
 from datetime import datetime, timezone
-from .utils import oid, serialize
+from .utils import oid, serialize, rate_limit, organizer_required
+from .inventory import (
+    claim_tickets, mark_sold, release_tickets, order_ticket_ids,
+    take_ga, restock_ga, release_holds, group_by_event, available_filter,
+    UNAVAILABLE_STATUSES, TICKET_AVAILABLE, TICKET_RESERVED, TICKET_SOLD,
+    notify_availability, order_event_ids, remove_from_ga_pool
+)
+from .stats import record_sale
+from .expiry import pending_expiry
 from redis_cache import CacheInvalidator
 
-orders = Blueprint('orders', __name__)
+# Claim + insert (+ rollup for paid orders) in one multi-document
+# transaction. Off by default: needs a replica set, and without it a failed
+# insert is undone by releasing the claimed tickets instead.
+USE_TRANSACTIONS = os.getenv("ORDER_TRANSACTIONS", "0") == "1"
+
+BATCH_MAX = int(os.getenv("ORDER_BATCH_MAX", 5000))  # orders per POST /orders/batch
+
+class _ClaimConflict(Exception):
+    def __init__(self, conflicts):
+        super().__init__("tickets already claimed")
+        self.conflicts = conflicts
+
+def _order_doc(user, ticket_ids, t_by_id, paid=False, expires=True):
+    """Order document in its final state, priced from the given ticket docs.
+    expires: an unpaid order gets expiresAt and is canceled by the sweeper
+    when not paid in time (interactive checkout only)"""
+    items = []
+    total = 0
+    for tid in ticket_ids:
+        t = t_by_id[tid]
+        price_int = int(t["price"])
+        total += price_int
+        items.append({
+            "ticketId": tid,
+            "price": Int64(price_int),
+            "type": t.get("type"),
+            "seat": t.get("seat"),
+            "eventId": t.get("eventId")
+        })
+    now = datetime.now(timezone.utc)
+    status = "paid" if paid else "pending"
+    order = {
+        "_id": ObjectId(),
+        "userId": user,
+        "orderDate": now,
+        "status": status,
+        "totalPrice": Int64(total),
+        "items": items,
+        "payment": {
+            "totalAmount": Int64(total),
+            "status": status,
+            "paidAt": now if paid else None
+        }
+    }
+    if not paid and expires:
+        order["expiresAt"] = pending_expiry(now)  # swept by routes/expiry.py
+    return order
 
 def init_orders(db):
     """Initialize order routes with database connection"""
+    orders = Blueprint('orders', __name__)
     
-    def _create_order_internal(user_id, ticket_ids):
+    def _precheck(user, ticket_ids):
+        """Tickets of an order plus whether the user exists, in one round trip"""
+        docs = list(db.tickets.aggregate([
+            {"$match": {"_id": {"$in": ticket_ids}}},
+            {"$project": {"price": 1, "type": 1, "seat": 1, "eventId": 1, "status": 1, "isGeneralAdmission": 1}},
+            {"$unionWith": {"coll": "users", "pipeline": [
+                {"$match": {"_id": user}},
+                {"$project": {"_id": 1, "isUser": {"$literal": True}}},
+            ]}},
+        ]))
+        tickets = [d for d in docs if not d.get("isUser")]
+        return tickets, len(tickets) != len(docs)
+
+    def _write_order(order, ticket_ids, session=None):
+        """Claim the tickets and insert the order in its final state.
+        Returns the conflicting ticket ids (empty on success)."""
+        paid = order["status"] == "paid"
+        claimed, conflicts = claim_tickets(db, ticket_ids, order["_id"],
+                                           status=TICKET_SOLD if paid else TICKET_RESERVED,
+                                           session=session)
+        if not claimed:
+            return conflicts
+        try:
+            db.orders.insert_one(order, session=session)
+        except Exception:
+            if session is None:
+                release_tickets(db, ticket_ids, order["_id"])
+            raise
+        if paid:
+            record_sale(db, order, session=session)
+        return []
+
+    def _write_order_txn(order, ticket_ids):
+        """Same as _write_order inside one multi-document transaction (needs a replica set)"""
+        def callback(s):
+            conflicts = _write_order(order, ticket_ids, session=s)
+            if conflicts:
+                raise _ClaimConflict(conflicts)  # aborts the transaction
+            return []
+        with db.client.start_session() as s:
+            try:
+                return s.with_transaction(callback)
+            except _ClaimConflict as e:
+                return e.conflicts
+
+    def _create_order_internal(user_id, ticket_ids, paid=False):
+        """Create an order for ticket_ids. With paid=True (checkout) the order
+        is written as paid and the tickets claimed as sold straight away, so
+        there is nothing to update or re-read afterwards."""
         _user = oid(user_id)
-        if not _user or not db.users.find_one({"_id": _user}, {"_id": 1}):
+        if not _user:
             return False, {"status": 404, "body": {"error": "user not found"}}
         if not ticket_ids:
             return False, {"status": 400, "body": {"error": "no tickets"}}
 
         ticket_ids = list(dict.fromkeys(ticket_ids))
 
-        tickets = list(db.tickets.find({"_id": {"$in": ticket_ids}}, {"price": 1, "type": 1, "seat": 1, "eventId": 1}))
+        tickets, user_found = _precheck(_user, ticket_ids)
+        if not user_found:
+            return False, {"status": 404, "body": {"error": "user not found"}}
         if len(tickets) != len(ticket_ids):
             found = {t["_id"] for t in tickets}
             missing = [str(t) for t in ticket_ids if t not in found]
             return False, {"status": 404, "body": {"error": "some tickets not found", "missing": missing}}
 
-        conflicts = db.orders.aggregate([
-            {"$match": {"status": {"$in": ["paid", "pending"]}}},
-            {"$unwind": "$items"},
-            {"$match": {"items.ticketId": {"$in": ticket_ids}}},
-            {"$group": {"_id": "$items.ticketId"}}
-        ])
-        conflict_ids = [str(c["_id"]) for c in conflicts]
+        # Fast path: already reserved/sold, no need to try the claim
+        conflict_ids = [str(t["_id"]) for t in tickets if t.get("status") in UNAVAILABLE_STATUSES]
         if conflict_ids:
             return False, {"status": 409, "body": {"error": "some tickets are already reserved/sold", "conflicts": conflict_ids}}
 
-        items = []
-        total = 0
-        t_by_id = {t["_id"]: t for t in tickets}
-        for tid in ticket_ids:
-            t = t_by_id[tid]
-            price_int = int(t["price"])
-            total += price_int
-            items.append({
-                "ticketId": tid,
-                "price": Int64(price_int),
-                "type": t.get("type"),
-                "seat": t.get("seat")
-            })
-
-        order = {
-            "userId": _user,
-            "orderDate": datetime.now(timezone.utc),
-            "status": "pending",
-            "totalPrice": Int64(total),
-            "items": items,
-            "payment": {
-                "totalAmount": Int64(total),
-                "status": "pending",
-                "paidAt": None
-            }
-        }
-        res = db.orders.insert_one(order)
-        created = db.orders.find_one({"_id": res.inserted_id})
-        return True, {"order": created}
+        order = _order_doc(_user, ticket_ids, {t["_id"]: t for t in tickets}, paid)
+        write = _write_order_txn if USE_TRANSACTIONS else _write_order
+        conflicts = write(order, ticket_ids)
+        if conflicts:
+            return False, {"status": 409, "body": {"error": "some tickets are already reserved/sold",
+                                                   "conflicts": [str(c) for c in conflicts]}}
+        remove_from_ga_pool(tickets)  # GA ids may be given explicitly, bypassing take_ga
+        notify_availability(order_event_ids(order))
+        return True, {"order": order}
     
     @orders.post("/orders")
+    @rate_limit("orders", "10/60")
     def create_order():
         data = request.get_json(silent=True) or {}
         user_id = session.get('user_id') or data.get("userId")
@@ -101,31 +186,143 @@ def init_orders(db):
                     event_id = oid(event_id)
             if not event_id:
                 return jsonify({"error": "eventId required for GA tickets"}), 400
-            reserved_ticket_ids = set()
-            for o in db.orders.find({"status": {"$in": ["paid", "pending"]}}, {"items.ticketId": 1}):
-                for it in o.get("items", []):
-                    tid = it.get("ticketId")
-                    if tid:
-                        reserved_ticket_ids.add(tid)
-            ga_tickets = list(db.tickets.find({
-                "eventId": event_id,
-                "$or": [
-                    {"isGeneralAdmission": True},
-                    {"type": {"$regex": r"^GA$", "$options": "i"}},
-                    {"seat": {"$regex": r"^GA$", "$options": "i"}},
-                ]
-            }))
-            available_ga = [t for t in ga_tickets if t["_id"] not in reserved_ticket_ids]
-            if len(available_ga) < ga_qty:
-                return jsonify({"error": "Not enough GA tickets available", "available": len(available_ga)}), 409
-            ticket_ids.extend([t["_id"] for t in available_ga[:ga_qty]])
+            ga_ids, available = take_ga(db, event_id, ga_qty)
+            if ga_ids is None:
+                return jsonify({"error": "Not enough GA tickets available", "available": available}), 409
+            ticket_ids.extend(ga_ids)
 
         ok, result = _create_order_internal(user_id, ticket_ids)
+        if ga_qty > 0:
+            # Order placed: GA tickets are reserved now. Failed: back to the pool.
+            release_holds({event_id: ga_ids}, restock=not ok)
         if not ok:
             return jsonify(result.get('body', {"error": "order_failed"})), result.get('status', 400)
         CacheInvalidator.invalidate_order_related()
         return jsonify(serialize(result['order'])), 201
 
+    def _failed(i, status, error, **extra):
+        return {"index": i, "ok": False, "status": status, "error": error, **extra}
+
+    def _create_orders_batch(entries, organizer_id):
+        """Validate and place many orders with a fixed number of round trips:
+        one users find, one tickets find, one events find (ownership), one
+        unordered claim bulk_write, one read-back of the claims and one
+        insert_many. Returns a result per entry, in input order."""
+        results = [None] * len(entries)
+        parsed = []  # (index, user, [ticketId])
+        for i, e in enumerate(entries):
+            e = e if isinstance(e, dict) else {}
+            user = oid(e.get("userId"))
+            items = e.get("items")
+            items = items if isinstance(items, list) else []
+            ids = [oid(it.get("ticketId")) if isinstance(it, dict) else None for it in items]
+            if not user or not ids or not all(ids):
+                results[i] = _failed(i, 400, "userId and items with valid ticketIds are required")
+            else:
+                parsed.append((i, user, list(dict.fromkeys(ids))))
+
+        all_users = {u for _, u, _ in parsed}
+        all_tickets = {t for _, _, ids in parsed for t in ids}
+        users = {u["_id"] for u in db.users.find({"_id": {"$in": list(all_users)}}, {"_id": 1})} if all_users else set()
+        t_by_id = {t["_id"]: t for t in db.tickets.find(
+            {"_id": {"$in": list(all_tickets)}},
+            {"price": 1, "type": 1, "seat": 1, "eventId": 1, "status": 1, "isGeneralAdmission": 1}
+        )} if all_tickets else {}
+        event_ids = {t.get("eventId") for t in t_by_id.values()}
+        own_events = {e["_id"] for e in db.events.find(
+            {"_id": {"$in": list(event_ids)}, "organizerId": organizer_id}, {"_id": 1}
+        )} if event_ids else set()
+
+        # Conflicts with existing orders (ticket status) and within the batch
+        # (first order listing a ticket wins)
+        taken = set()
+        accepted = []  # (index, order, [ticketId])
+        for i, user, ids in parsed:
+            missing = [str(t) for t in ids if t not in t_by_id]
+            if user not in users:
+                results[i] = _failed(i, 404, "user not found")
+            elif missing:
+                results[i] = _failed(i, 404, "some tickets not found", missing=missing)
+            elif any(t_by_id[t].get("eventId") not in own_events for t in ids):
+                results[i] = _failed(i, 403, "tickets of another organizer's event")
+            else:
+                conflicts = [str(t) for t in ids if t in taken or t_by_id[t].get("status") in UNAVAILABLE_STATUSES]
+                if conflicts:
+                    results[i] = _failed(i, 409, "some tickets are already reserved/sold", conflicts=conflicts)
+                else:
+                    taken.update(ids)
+                    order = _order_doc(user, ids, t_by_id, expires=False)
+                    order["source"] = "batch"  # never expires, also not via backfill_expiry
+                    accepted.append((i, order, ids))
+        if not accepted:
+            return results
+
+        # Claim every order's tickets in one unordered bulk write. Ticket
+        # statuses may have changed since the read above, so read the claims
+        # back and drop orders that did not get all of their tickets.
+        db.tickets.bulk_write([
+            UpdateMany({"_id": {"$in": ids}, **available_filter()},
+                       {"$set": {"status": TICKET_RESERVED, "orderId": order["_id"]}})
+            for _, order, ids in accepted
+        ], ordered=False)
+        owner = {t["_id"]: t.get("orderId") for t in db.tickets.find(
+            {"_id": {"$in": list(taken)}}, {"orderId": 1}
+        )}
+        to_insert, to_release = [], []
+        for i, order, ids in accepted:
+            lost = [str(t) for t in ids if owner.get(t) != order["_id"]]
+            if lost:
+                results[i] = _failed(i, 409, "some tickets are already reserved/sold", conflicts=lost)
+                to_release.append((order["_id"], ids))
+            else:
+                to_insert.append((i, order, ids))
+
+        created = []
+        if to_insert:
+            failed_at = set()
+            try:
+                db.orders.insert_many([order for _, order, _ in to_insert], ordered=False)
+            except BulkWriteError as e:
+                failed_at = {err["index"] for err in e.details.get("writeErrors", [])}
+            for n, (i, order, ids) in enumerate(to_insert):
+                if n in failed_at:
+                    results[i] = _failed(i, 500, "order insert failed")
+                    to_release.append((order["_id"], ids))
+                else:
+                    results[i] = {"index": i, "ok": True, "status": 201, "orderId": str(order["_id"]),
+                                  "totalPrice": int(order["totalPrice"])}
+                    created.extend(t_by_id[t] for t in ids)
+        remove_from_ga_pool(created)  # GA ids claimed here bypass take_ga
+        notify_availability({t_by_id[t].get("eventId") for t in taken})
+        if to_release:
+            db.tickets.bulk_write([
+                UpdateMany({"_id": {"$in": ids}, "orderId": order_id},
+                           {"$set": {"status": TICKET_AVAILABLE}, "$unset": {"orderId": ""}})
+                for order_id, ids in to_release
+            ], ordered=False)
+        return results
+
+    @orders.post("/orders/batch")
+    @organizer_required
+    @rate_limit("orders_batch", "10/60")
+    def create_orders_batch():
+        """Box-office / partner upload: {"orders": [{"userId", "items": [{"ticketId"}]}]}.
+        Orders are independent - each gets its own result; GA pool
+        quantities are not supported here, list the ticket ids. The orders
+        stay pending until paid or canceled: they do not expire."""
+        data = request.get_json(silent=True) or {}
+        entries = data.get("orders")
+        if not isinstance(entries, list) or not entries:
+            return jsonify({"error": "orders list is required"}), 400
+        if len(entries) > BATCH_MAX:
+            return jsonify({"error": f"at most {BATCH_MAX} orders per batch"}), 400
+
+        results = _create_orders_batch(entries, oid(session.get('user_id')))
+        created = sum(1 for r in results if r["ok"])
+        if created:
+            CacheInvalidator.invalidate_order_related()
+        return jsonify({"created": created, "failed": len(results) - created, "results": results})
+
     @orders.get("/orders/<order_id>")
     def get_order(order_id):
         _id = oid(order_id)
@@ -142,13 +339,19 @@ def init_orders(db):
         if not _id:
             return jsonify({"error":"invalid id"}), 400
         now = datetime.now(timezone.utc)
+        # An expired hold can no longer be paid, even before the sweeper got to it
         res = db.orders.find_one_and_update(
-            {"_id": _id, "status": "pending"},
-            {"$set": {"status": "paid", "payment.status": "paid", "payment.paidAt": now}},
+            {"_id": _id, "status": "pending",
+             "$or": [{"expiresAt": {"$gt": now}}, {"expiresAt": {"$exists": False}}]},
+            {"$set": {"status": "paid", "payment.status": "paid", "payment.paidAt": now},
+             "$unset": {"expiresAt": ""}},
             return_document=True
         )
         if not res:
             return jsonify({"error":"order not pending or not found"}), 409
+        mark_sold(db, order_ticket_ids(res), res["_id"])
+        record_sale(db, res)
+        notify_availability(order_event_ids(res))
         CacheInvalidator.invalidate_order_related()
         return jsonify(serialize(res))
 
@@ -159,11 +362,16 @@ def init_orders(db):
             return jsonify({"error":"invalid id"}), 400
         res = db.orders.find_one_and_update(
             {"_id": _id, "status": {"$in": ["pending"]}},
-            {"$set": {"status": "canceled", "payment.status": "failed", "payment.paidAt": None}},
+            {"$set": {"status": "canceled", "payment.status": "failed", "payment.paidAt": None},
+             "$unset": {"expiresAt": ""}},
             return_document=True
         )
         if not res:
             return jsonify({"error":"order not cancellable or not found"}), 409
+        release_tickets(db, order_ticket_ids(res), res["_id"])
+        for event_id, ids in group_by_event(db, order_ticket_ids(res), ga_only=True).items():
+            restock_ga(event_id, ids)
+        notify_availability(order_event_ids(res))
         return jsonify(serialize(res))
     
     # Return both blueprint and internal function for cart to use
@@ -0,0 +1,61 @@
+import os
+import time
+from redis_cache import cache
+
+# Login principal lookup: email -> {"id", "type"} ("user" or "organizer").
+# Both collections are searched with one aggregate ($unionWith, each side on
+# its email index) and hits are kept in the "principals" cache namespace, so
+# a login storm costs one Redis GET per login instead of several Mongo round
+# trips. Emails are unique per collection; users win over organizers.
+
+PRINCIPAL_TTL = int(os.getenv("PRINCIPAL_CACHE_TTL", 300))
+COLLECTION_RECHECK = 60  # s, how often a miss may re-check for "organizers"
+
+class PrincipalLookup:
+    def __init__(self, db):
+        self.db = db
+        self._has_organizers = None  # resolved on first use, not at import
+        self._checked_at = 0.0
+
+    def _refresh_collections(self):
+        """Resolved once per process; re-checked at most every COLLECTION_RECHECK s"""
+        try:
+            self._has_organizers = "organizers" in self.db.list_collection_names()
+        except Exception as e:
+            print(f"Collection check failed: {e}")
+            self._has_organizers = True  # querying a missing collection is harmless
+        self._checked_at = time.time()
+
+    def _query(self, email):
+        pipeline = [
+            {"$match": {"email": email}},
+            {"$limit": 1},
+            {"$project": {"_id": 1, "type": {"$literal": "user"}}},
+        ]
+        if self._has_organizers:
+            pipeline.append({"$unionWith": {"coll": "organizers", "pipeline": [
+                {"$match": {"email": email}},
+                {"$limit": 1},
+                {"$project": {"_id": 1, "type": {"$literal": "organizer"}}},
+            ]}})
+        docs = list(self.db.users.aggregate(pipeline))
+        if not docs:
+            return None
+        doc = docs[0]  # users come first
+        return {"id": str(doc["_id"]), "type": doc["type"]}
+
+    def resolve(self, email):
+        """{"id", "type"} for an email, or None"""
+        principal = cache.get(email, namespace="principals")
+        if principal:
+            return principal
+        if self._has_organizers is None:
+            self._refresh_collections()
+        principal = self._query(email)
+        if not principal and not self._has_organizers and time.time() - self._checked_at > COLLECTION_RECHECK:
+            self._refresh_collections()
+            if self._has_organizers:
+                principal = self._query(email)
+        if principal:
+            cache.set(email, principal, PRINCIPAL_TTL, namespace="principals")
+        return principal
@@ -0,0 +1,101 @@
+import os
+import re
+import unicodedata
+from flask import request
+from pymongo import UpdateOne
+from .utils import parse_int, count_total
+
+# Prefix search backed by a multikey index.
+#
+# Searchable documents carry two maintained fields:
+#   searchWords  - normalized whole words (used for relevance)
+#   searchTokens - every prefix of those words up to MAX_PREFIX characters
+# A query matches when each of its words is one of the document's tokens, so
+# "roc ni" finds "Rock Night" with an index lookup instead of a regex scan.
+
+MAX_PREFIX = 15
+MAX_QUERY_WORDS = 8
+RELEVANCE_WINDOW = int(os.getenv("SEARCH_RELEVANCE_WINDOW", 1000))  # matches ranked per query
+
+EVENT_SEARCH_FIELDS = ("title",)
+USER_SEARCH_FIELDS = ("name", "email")
+
+_WORD = re.compile(r"\w+", re.UNICODE)
+
+def normalize(text):
+    """Lowercase and strip accents ("Šiaulių" -> "siauliu")"""
+    text = unicodedata.normalize("NFKD", str(text or "").lower())
+    return "".join(c for c in text if not unicodedata.combining(c))
+
+def words(text):
+    return _WORD.findall(normalize(text))
+
+def search_fields(*texts):
+    """searchWords/searchTokens for a document built from the given texts"""
+    ws = set()
+    for t in texts:
+        ws.update(words(t))
+    tokens = set()
+    for w in ws:
+        for i in range(1, min(len(w), MAX_PREFIX) + 1):
+            tokens.add(w[:i])
+    return {"searchWords": sorted(ws), "searchTokens": sorted(tokens)}
+
+def query_tokens(q):
+    """Tokens the query must match, or [] when it has no searchable words"""
+    return list(dict.fromkeys(w[:MAX_PREFIX] for w in words(q)))[:MAX_QUERY_WORDS]
+
+def apply_search(q, text):
+    """Add the search condition for query text to filter q; returns the
+    tokens. Text without any searchable word matches nothing."""
+    tokens = query_tokens(text)
+    if tokens:
+        q["searchTokens"] = {"$all": tokens}
+    elif str(text or "").strip():
+        q["_id"] = {"$in": []}
+    return tokens
+
+def relevance_page(coll, q, tokens, sort_field, dir_, default_limit=20, max_limit=200):
+    """One page of matches ordered by relevance: documents where more query
+    words are whole words come first, then the normal sort order.
+    Only the first RELEVANCE_WINDOW matches (normal order) are ranked, so a
+    page never sorts the whole match set in memory; pages past the window
+    continue in normal order."""
+    page = parse_int("page", 1, 1, 1_000_000)
+    limit = parse_int("limit", default_limit, 1, max_limit)
+    start, end = (page - 1) * limit, page * limit
+    sort = [(sort_field, dir_), ("_id", 1)]
+    docs = []
+    if start < RELEVANCE_WINDOW:
+        pipeline = [
+            {"$match": q},
+            {"$sort": dict(sort)},
+            {"$limit": RELEVANCE_WINDOW},
+            {"$addFields": {"_score": {"$size": {"$setIntersection": [{"$ifNull": ["$searchWords", []]}, tokens]}}}},
+            {"$sort": {"_score": -1, sort_field: dir_, "_id": 1}},
+            {"$skip": start},
+            {"$limit": min(end, RELEVANCE_WINDOW) - start},
+            {"$project": {"_score": 0}},
+        ]
+        docs = list(coll.aggregate(pipeline))
+    if end > RELEVANCE_WINDOW:
+        skip = max(start, RELEVANCE_WINDOW)
+        docs += list(coll.find(q).sort(sort).skip(skip).limit(end - skip))
+    return docs, {"page": page, "limit": limit, "total": count_total(coll, q)}
+
+def wants_relevance():
+    return "sort" not in request.args and "cursor" not in request.args
+
+def rebuild_search_fields(coll, fields, batch_size=1000):
+    """Backfill searchWords/searchTokens for a collection"""
+    ops = []
+    updated = 0
+    projection = {f: 1 for f in fields}
+    for d in coll.find({}, projection):
+        ops.append(UpdateOne({"_id": d["_id"]}, {"$set": search_fields(*(d.get(f) for f in fields))}))
+        if len(ops) >= batch_size:
+            updated += coll.bulk_write(ops, ordered=False).modified_count
+            ops = []
+    if ops:
+        updated += coll.bulk_write(ops, ordered=False).modified_count
+    return updated
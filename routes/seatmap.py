@@ -0,0 +1,239 @@
+import itertools
+import threading
+from datetime import datetime, timezone, timedelta
+from bson.int64 import Int64
+from pymongo.errors import BulkWriteError
+from .inventory import restock_ga, is_ga, TICKET_AVAILABLE
+from .stats import record_tickets_added
+
+# Seat-map spec submitted with POST /events (prices in EUR, like the UI):
+#
+#   {
+#     "ga": [{"name": "Floor", "capacity": 5000, "price": 25.0}],
+#     "sections": [
+#       {"name": "101", "rows": {"from": "A", "to": "T"}, "seats": [1, 30], "price": 45.0,
+#        "tiers": [{"rows": ["A", "B"], "price": 80.0}]},
+#       {"name": "", "rows": ["A", "B"], "seats": [1, 50], "price": 35.0}
+#     ]
+#   }
+#
+# "ga" may also be a single object. Seats are labelled "<row><n>", prefixed
+# with "<section>-" when the section has a name. GA zone names and section
+# names must be unique (one unnamed of each is fine): they are part of the
+# seatKey. Tickets are generated as a stream and inserted in bounded
+# unordered batches; every ticket has a deterministic seatKey (unique per
+# event) so an interrupted run can be resumed without creating duplicates.
+
+BATCH_SIZE = 1000
+INLINE_LIMIT = 5000            # bigger maps are generated in the background
+MAX_TICKETS = 200_000
+STALE_AFTER = timedelta(seconds=60)
+
+# Used when the organizer does not send a seat map (100 GA + rows A-B x 50)
+DEFAULT_SEAT_MAP = {
+    "ga": [{"name": "", "capacity": 100, "price": 25.0}],
+    "sections": [{"name": "", "rows": ["A", "B"], "seats": [1, 50], "price": 35.0}],
+}
+
+class SeatMapError(ValueError):
+    pass
+
+def _price(v, where):
+    try:
+        cents = int(round(float(v) * 100))
+    except (TypeError, ValueError):
+        raise SeatMapError(f"{where}: invalid price")
+    if cents < 0:
+        raise SeatMapError(f"{where}: price must be >= 0")
+    return cents
+
+def _rows(spec, where):
+    if isinstance(spec, list):
+        rows = [str(r).strip().upper() for r in spec]
+    elif isinstance(spec, dict) and "from" in spec and "to" in spec:
+        start, end = spec["from"], spec["to"]
+        if isinstance(start, int) and isinstance(end, int):
+            rows = [str(n) for n in range(start, end + 1)]
+        elif isinstance(start, str) and isinstance(end, str) and len(start) == 1 and len(end) == 1:
+            rows = [chr(c) for c in range(ord(start.upper()), ord(end.upper()) + 1)]
+        else:
+            raise SeatMapError(f"{where}: rows range must be two letters or two numbers")
+    else:
+        raise SeatMapError(f"{where}: rows must be a list or {{from, to}}")
+    if not rows or any(not r for r in rows):
+        raise SeatMapError(f"{where}: no rows")
+    return rows
+
+def parse_seat_map(spec):
+    """Validate a seat-map spec; returns the normalized spec (prices in cents)"""
+    if not isinstance(spec, dict):
+        raise SeatMapError("seatMap must be an object")
+    ga = spec.get("ga") or []
+    if isinstance(ga, dict):
+        ga = [ga]
+    out = {"ga": [], "sections": []}
+    for i, zone in enumerate(ga):
+        where = f"ga[{i}]"
+        try:
+            capacity = int(zone.get("capacity", 0))
+        except (TypeError, ValueError, AttributeError):
+            raise SeatMapError(f"{where}: invalid capacity")
+        if capacity < 1:
+            raise SeatMapError(f"{where}: capacity must be >= 1")
+        name = str(zone.get("name") or "").strip()
+        if any(z["name"] == name for z in out["ga"]):
+            raise SeatMapError(f"{where}: duplicate GA zone name {name!r}")
+        out["ga"].append({"name": name, "capacity": capacity,
+                          "price": _price(zone.get("price"), where)})
+    for i, sec in enumerate(spec.get("sections") or []):
+        where = f"sections[{i}]"
+        if not isinstance(sec, dict):
+            raise SeatMapError(f"{where}: must be an object")
+        name = str(sec.get("name") or "").strip()
+        if any(s["name"] == name for s in out["sections"]):
+            raise SeatMapError(f"{where}: duplicate section name {name!r}")
+        rows = _rows(sec.get("rows"), where)
+        seats = sec.get("seats")
+        if not (isinstance(seats, list) and len(seats) == 2 and all(isinstance(n, int) for n in seats)
+                and 1 <= seats[0] <= seats[1]):
+            raise SeatMapError(f"{where}: seats must be [first, last]")
+        row_prices = {}
+        for j, tier in enumerate(sec.get("tiers") or []):
+            tier_price = _price(tier.get("price"), f"{where}.tiers[{j}]")
+            for r in _rows(tier.get("rows"), f"{where}.tiers[{j}]"):
+                row_prices[r] = tier_price
+        out["sections"].append({
+            "name": name,
+            "rows": rows,
+            "seats": seats,
+            "price": _price(sec.get("price"), where),
+            "rowPrices": row_prices,
+        })
+    total = count_tickets(out)
+    if total == 0:
+        raise SeatMapError("seat map has no tickets")
+    if total > MAX_TICKETS:
+        raise SeatMapError(f"seat map has {total} tickets, max is {MAX_TICKETS}")
+    return out
+
+def count_tickets(seat_map):
+    return (sum(z["capacity"] for z in seat_map["ga"]) +
+            sum(len(s["rows"]) * (s["seats"][1] - s["seats"][0] + 1) for s in seat_map["sections"]))
+
+def iter_tickets(event_id, seat_map):
+    """Ticket documents in a fixed order (resume relies on it)"""
+    for zone in seat_map["ga"]:
+        price = Int64(zone["price"])
+        for n in range(1, zone["capacity"] + 1):
+            yield {
+                "eventId": event_id,
+                "type": "GA",
+                "seat": None,
+                "price": price,
+                "status": TICKET_AVAILABLE,
+                "seatKey": f"GA:{zone['name']}:{n}",
+            }
+    for sec in seat_map["sections"]:
+        prefix = f"{sec['name']}-" if sec["name"] else ""
+        first, last = sec["seats"]
+        for row in sec["rows"]:
+            price = Int64(sec["rowPrices"].get(row, sec["price"]))
+            for n in range(first, last + 1):
+                doc = {
+                    "eventId": event_id,
+                    "type": "seat",
+                    "seat": f"{prefix}{row}{n}",
+                    "price": price,
+                    "status": TICKET_AVAILABLE,
+                    "seatKey": f"S:{sec['name']}:{row}:{n}",
+                }
+                if sec["name"]:
+                    doc["section"] = sec["name"]
+                yield doc
+
+def _insert_batch(db, batch):
+    """Unordered insert; duplicates (already generated before a resume) are
+    skipped. Returns the documents actually inserted."""
+    try:
+        db.tickets.insert_many(batch, ordered=False)
+        return batch
+    except BulkWriteError as e:
+        errors = e.details.get("writeErrors", [])
+        if any(err.get("code") != 11000 for err in errors):
+            raise
+        # insert_many assigned _ids to the rejected documents too
+        failed = {err["index"] for err in errors}
+        return [t for i, t in enumerate(batch) if i not in failed]
+
+def _claim_run(db, event_id):
+    """Mark generation as running unless a live run already owns it"""
+    now = datetime.now(timezone.utc)
+    return db.events.find_one_and_update(
+        {"_id": event_id, "$or": [
+            {"ticketGeneration.status": {"$in": ["pending", "failed"]}},
+            {"ticketGeneration.status": "running", "ticketGeneration.updatedAt": {"$lt": now - STALE_AFTER}},
+        ]},
+        {"$set": {"ticketGeneration.status": "running", "ticketGeneration.updatedAt": now}},
+        {"seatMap": 1, "ticketGeneration": 1},
+        return_document=True
+    )
+
+def generate_tickets(db, event_id):
+    """Generate (or resume generating) an event's tickets from its stored seat map"""
+    event = _claim_run(db, event_id)
+    if not event:
+        return False
+    seat_map = event["seatMap"]
+    progress = event["ticketGeneration"]
+    done = progress.get("generated", 0)
+    stream = itertools.islice(iter_tickets(event_id, seat_map), done, None)
+    try:
+        while True:
+            batch = list(itertools.islice(stream, BATCH_SIZE))
+            if not batch:
+                break
+            inserted = _insert_batch(db, batch)
+            done += len(batch)
+            record_tickets_added(db, event_id, len(inserted))
+            restock_ga(event_id, [t["_id"] for t in inserted if is_ga(t)])
+            db.events.update_one({"_id": event_id}, {"$set": {
+                "ticketGeneration.generated": done,
+                "ticketGeneration.updatedAt": datetime.now(timezone.utc),
+            }})
+        # Skipped duplicates are assumed to be this generation's own earlier
+        # inserts; check that the event really has every ticket of the map
+        stored = db.tickets.count_documents({"eventId": event_id, "seatKey": {"$exists": True}})
+        total = count_tickets(seat_map)
+        if stored != total:
+            raise RuntimeError(f"{stored} of {total} tickets stored")
+        db.events.update_one({"_id": event_id}, {"$set": {
+            "ticketGeneration.status": "done",
+            "ticketGeneration.updatedAt": datetime.now(timezone.utc),
+        }})
+        print(f"Created {done} tickets for event {event_id}")
+        return True
+    except Exception as e:
+        print(f"Error creating tickets: {e}")
+        db.events.update_one({"_id": event_id}, {"$set": {
+            "ticketGeneration.status": "failed",
+            "ticketGeneration.error": str(e),
+            "ticketGeneration.updatedAt": datetime.now(timezone.utc),
+        }})
+        return False
+
+def start_generation(db, event_id, total):
+    """Small maps are generated inline, large ones on a background thread"""
+    if total <= INLINE_LIMIT:
+        generate_tickets(db, event_id)
+        return
+    threading.Thread(target=generate_tickets, args=(db, event_id), daemon=True,
+                     name=f"tickets-{event_id}").start()
+
+def generation_state(progress):
+    """Public view of an event's ticketGeneration field"""
+    if not progress:
+        return None
+    state = {k: progress.get(k) for k in ("status", "generated", "total", "error") if k in progress}
+    if state.get("total"):
+        state["percent"] = round(100 * state.get("generated", 0) / state["total"], 1)
+    return state
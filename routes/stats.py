@@ -0,0 +1,81 @@
+from pymongo import UpdateOne, ReplaceOne
+
+# event_stats rollup: one document per event, kept up to date with $inc when
+# orders are paid, so /analytics reads never have to aggregate over orders.
+#   {_id: eventId, title, eventDate, revenue, ticketsSold, total, available}
+
+def record_event_created(db, event, total):
+    db.event_stats.update_one(
+        {"_id": event["_id"]},
+        {
+            "$set": {"title": event.get("title"), "eventDate": event.get("eventDate")},
+            "$inc": {"total": total, "available": total},
+            "$setOnInsert": {"revenue": 0, "ticketsSold": 0},
+        },
+        upsert=True
+    )
+
+def record_tickets_added(db, event_id, count):
+    """Tickets generated for an existing event (seat maps are inserted in batches)"""
+    if count:
+        db.event_stats.update_one({"_id": event_id}, {"$inc": {"total": count, "available": count}}, upsert=True)
+
+def _items_by_event(db, items, session=None):
+    """{eventId: [item, ...]}; items from older orders carry no eventId"""
+    missing = [it["ticketId"] for it in items if not it.get("eventId")]
+    event_of = {}
+    if missing:
+        for t in db.tickets.find({"_id": {"$in": missing}}, {"eventId": 1}, session=session):
+            event_of[t["_id"]] = t.get("eventId")
+    grouped = {}
+    for it in items:
+        ev = it.get("eventId") or event_of.get(it["ticketId"])
+        if ev:
+            grouped.setdefault(ev, []).append(it)
+    return grouped
+
+def record_sale(db, order, session=None):
+    """Add a paid order to the per-event rollup"""
+    ops = []
+    for event_id, items in _items_by_event(db, order.get("items", []), session).items():
+        revenue = sum(int(it.get("price", 0)) for it in items)
+        ops.append(UpdateOne(
+            {"_id": event_id},
+            {"$inc": {"revenue": revenue, "ticketsSold": len(items), "available": -len(items)}},
+            upsert=True
+        ))
+    if ops:
+        db.event_stats.bulk_write(ops, ordered=False, session=session)
+
+def rebuild_event_stats(db):
+    """Recompute the whole rollup from events, tickets and paid orders (backfill)"""
+    stats = {}
+    for e in db.events.find({}, {"title": 1, "eventDate": 1}):
+        stats[e["_id"]] = {"title": e.get("title"), "eventDate": e.get("eventDate"),
+                           "revenue": 0, "ticketsSold": 0, "total": 0}
+    for row in db.tickets.aggregate([{"$group": {"_id": "$eventId", "total": {"$sum": 1}}}]):
+        if row["_id"] in stats:
+            stats[row["_id"]]["total"] = row["total"]
+    sold = db.orders.aggregate([
+        {"$match": {"status": "paid"}},
+        {"$unwind": "$items"},
+        {"$lookup": {"from": "tickets", "localField": "items.ticketId", "foreignField": "_id", "as": "t"}},
+        {"$unwind": "$t"},
+        {"$group": {"_id": "$t.eventId", "revenue": {"$sum": "$items.price"}, "ticketsSold": {"$sum": 1}}},
+    ])
+    for row in sold:
+        if row["_id"] in stats:
+            stats[row["_id"]]["revenue"] = row["revenue"]
+            stats[row["_id"]]["ticketsSold"] = row["ticketsSold"]
+
+    ops = []
+    for event_id, s in stats.items():
+        s["available"] = s["total"] - s["ticketsSold"]
+        ops.append(ReplaceOne({"_id": event_id}, s, upsert=True))
+        if len(ops) >= 1000:
+            db.event_stats.bulk_write(ops, ordered=False)
+            ops = []
+    if ops:
+        db.event_stats.bulk_write(ops, ordered=False)
+    db.event_stats.delete_many({"_id": {"$nin": list(stats)}})
+    return len(stats)
@@ -1,11 +1,12 @@
 from flask import Blueprint, request, jsonify
 from pymongo.errors import DuplicateKeyError
-from .utils import oid, serialize, parse_int, login_required
-
-users = Blueprint('users', __name__)
+from .utils import oid, serialize, paginate, login_required
+from .search import search_fields, apply_search, relevance_page, wants_relevance
+from redis_cache import CacheInvalidator
 
 def init_users(app, db):
     """Initialize user routes with database connection"""
+    users = Blueprint('users', __name__)
     
     @users.post("/users")
     def create_user():
@@ -18,19 +19,17 @@ def init_users(app, db):
         user = {"name": name, "email": email}
         if phone:
             user["phoneNumber"] = phone
+        user.update(search_fields(name, email))
         try:
             res = db.users.insert_one(user)
         except DuplicateKeyError:
             return jsonify({"error": "email already exists"}), 409
+        CacheInvalidator.invalidate_counts()
         created = db.users.find_one({"_id": res.inserted_id})
         return jsonify(serialize(created)), 201
 
     @users.get("/users")
     def list_users():
-        page = parse_int("page", 1, 1, 1_000_000)
-        limit = parse_int("limit", 20, 1, 200)
-        skip = (page - 1) * limit
-
         q = {}
 
         has_phone = request.args.get("hasPhone")
@@ -49,19 +48,19 @@ def init_users(app, db):
                     {"phoneNumber": None}
                 ]
 
-        if (s := request.args.get("q")):
-            q["$or"] = q.get("$or", []) + [
-                {"name": {"$regex": s, "$options": "i"}},
-                {"email": {"$regex": s, "$options": "i"}}
-            ]
+        tokens = apply_search(q, request.args.get("q"))
 
         sort_field = request.args.get("sort", "name")
         dir_ = 1 if request.args.get("dir", "asc") == "asc" else -1
 
-        total = db.users.count_documents(q)
-        cursor = db.users.find(q).sort(sort_field, dir_).skip(skip).limit(limit)
-        data = [serialize(d) for d in cursor]
-        return jsonify({"data": data, "meta": {"page": page, "limit": limit, "total": total}})
+        if tokens and wants_relevance():
+            docs, meta = relevance_page(db.users, q, tokens, sort_field, dir_)
+        else:
+            docs, meta = paginate(db.users, q, sort_field, dir_)
+        if docs is None:
+            return jsonify(meta), 400
+        data = [serialize(d) for d in docs]
+        return jsonify({"data": data, "meta": meta})
 
     @users.get("/users/<user_id>")
     def get_user(user_id):
@@ -81,6 +80,8 @@ def init_users(app, db):
         res = db.users.delete_one({"_id": _id})
         if res.deleted_count == 0:
             return jsonify({"error": "not found"}), 404
+        CacheInvalidator.invalidate_counts()
+        CacheInvalidator.invalidate_principals()
         return jsonify({"ok": True}), 200
 
     @users.patch("/users/<user_id>")
@@ -105,6 +106,12 @@ def init_users(app, db):
                     set_ops[k] = data[k]
         if not set_ops and not unset_ops:
             return jsonify({"error": "no fields to update"}), 400
+        if "name" in set_ops or "email" in set_ops:
+            current = db.users.find_one({"_id": _id}, {"name": 1, "email": 1}) or {}
+            set_ops.update(search_fields(
+                set_ops.get("name", current.get("name")),
+                set_ops.get("email", current.get("email"))
+            ))
         ops = {}
         if set_ops:
             ops["$set"] = set_ops
@@ -116,6 +123,8 @@ def init_users(app, db):
             return jsonify({"error": "email already exists"}), 409
         if not res:
             return jsonify({"error": "not found"}), 404
+        if "email" in set_ops:
+            CacheInvalidator.invalidate_principals()
         return jsonify(serialize(res))
 
     @users.get("/ui/users")
@@ -1,6 +1,12 @@
+import base64
+import hashlib
+import json
+import os
 from bson import ObjectId
-from flask import request, jsonify, session, redirect
+from flask import request, jsonify, session, redirect, make_response
 from functools import wraps
+from serialization import CacheCodec
+from redis_cache import cache, rate_limiter
 
 def oid(x):
     try:
@@ -12,13 +18,16 @@ def serialize(doc):
     if not doc:
         return doc
     doc["_id"] = str(doc["_id"])
-    for k in ("userId", "organizerId", "venueId", "eventId"):
+    doc.pop("searchWords", None)
+    doc.pop("searchTokens", None)
+    for k in ("userId", "organizerId", "venueId", "eventId", "orderId"):
         if k in doc and isinstance(doc[k], ObjectId):
             doc[k] = str(doc[k])
     if "items" in doc:
         for it in doc["items"]:
-            if "ticketId" in it and isinstance(it["ticketId"], ObjectId):
-                it["ticketId"] = str(it["ticketId"])
+            for k in ("ticketId", "eventId"):
+                if k in it and isinstance(it[k], ObjectId):
+                    it[k] = str(it[k])
             if "price" in it:
                 it["price"] = int(it["price"])
     if "totalPrice" in doc:
@@ -35,6 +44,88 @@ def parse_int(name, default, min_v=1, max_v=1000):
         v = default
     return v
 
+# Keyset (cursor) pagination
+#
+# A cursor is the (sort value, _id) pair of the last document of a page,
+# encoded as an opaque url-safe token. The next page continues strictly after
+# that pair, so any page costs the same as the first one (no skip).
+
+_cursor_codec = CacheCodec("json")
+
+COUNT_CACHE_TTL = 30
+
+def encode_cursor(doc, sort_field):
+    raw = _cursor_codec.dumps([sort_field, doc.get(sort_field), doc["_id"]])
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(token, sort_field):
+    try:
+        raw = base64.urlsafe_b64decode(token + "=" * (-len(token) % 4))
+        field, value, last_id = _cursor_codec.loads(raw)
+    except Exception:
+        return None
+    if field != sort_field or not isinstance(last_id, ObjectId):
+        return None
+    return value, last_id
+
+def keyset_filter(sort_field, dir_, value, last_id):
+    op = "$gt" if dir_ == 1 else "$lt"
+    if value is None:
+        # Missing/null values sort first ascending, last descending
+        if dir_ == 1:
+            return {"$or": [{sort_field: {"$ne": None}}, {sort_field: None, "_id": {op: last_id}}]}
+        return {sort_field: None, "_id": {op: last_id}}
+    after = [
+        {sort_field: {op: value}},
+        {sort_field: value, "_id": {op: last_id}},
+    ]
+    if dir_ == -1:
+        after.append({sort_field: None})  # still to come after every value
+    return {"$or": after}
+
+def count_total(coll, q):
+    """Document count, cached briefly per query (counts namespace)"""
+    if not q:
+        return coll.estimated_document_count()
+    digest = hashlib.sha1(json.dumps(q, sort_keys=True, default=str).encode()).hexdigest()
+    key = f"{coll.name}:{digest}"
+    total = cache.get(key, namespace="counts")
+    if total is None:
+        total = coll.count_documents(q)
+        cache.set(key, total, COUNT_CACHE_TTL, namespace="counts")
+    return total
+
+def listing_sort(sort_field, dir_):
+    """Sort of every listing: the field, then _id as the tiebreak keyset
+    cursors rely on (indexes.canonical_queries() checks this shape)"""
+    return [(sort_field, dir_), ("_id", dir_)]
+
+def paginate(coll, q, sort_field, dir_, default_limit=20, max_limit=200):
+    """Run a listing query in page/limit mode or, when ?cursor= is given,
+    in keyset mode. Returns (docs, meta). Keyset pages skip the total unless
+    ?includeTotal=1; page mode always reports it (cached)."""
+    limit = parse_int("limit", default_limit, 1, max_limit)
+    sort = listing_sort(sort_field, dir_)
+    token = request.args.get("cursor")
+    if token is not None:
+        meta = {"limit": limit}
+        find_q = q
+        if token:
+            after = decode_cursor(token, sort_field)
+            if after is None:
+                return None, {"error": "invalid cursor"}
+            kf = keyset_filter(sort_field, dir_, *after)
+            find_q = {"$and": [q, kf]} if q else kf
+        docs = list(coll.find(find_q).sort(sort).limit(limit))
+        if request.args.get("includeTotal", "").lower() in ("1", "true", "yes"):
+            meta["total"] = count_total(coll, q)
+    else:
+        page = parse_int("page", 1, 1, 1_000_000)
+        docs = list(coll.find(q).sort(sort).skip((page - 1) * limit).limit(limit))
+        meta = {"page": page, "limit": limit, "total": count_total(coll, q)}
+    meta["nextCursor"] = encode_cursor(docs[-1], sort_field) if len(docs) == limit else None
+    return docs, meta
+
 def login_required(f):
     @wraps(f)
     def decorated_function(*args, **kwargs):
@@ -56,3 +147,44 @@ def organizer_required(f):
                 return redirect('/login')
         return f(*args, **kwargs)
     return decorated_function
+
+def _limit_spec(name, default):
+    """"limit/window" from RATE_LIMIT_<NAME> (e.g. RATE_LIMIT_TICKETS=120/60), "0" disables;
+    RATE_LIMITS=off disables every limit (benchmarks, load tests)"""
+    if os.getenv("RATE_LIMITS", "on") == "off":
+        return None
+    spec = os.getenv(f"RATE_LIMIT_{name.upper()}", default)
+    if spec in ("0", "off", ""):
+        return None
+    limit, _, window = spec.partition("/")
+    return int(limit), int(window or 60)
+
+def rate_limit_key(name, per, user_id, remote_addr):
+    """Bucket of a request: per logged-in user (falling back to the IP) or per IP"""
+    who = user_id if per == "user" else None
+    return f"{name}:u:{who}" if who else f"{name}:ip:{remote_addr}"
+
+def rate_limit(name, default, per="user"):
+    """Token-bucket limit for a route, per logged-in user (falling back to
+    the client IP) or per IP. Adds RateLimit-* headers; 429 when exhausted.
+
+        @rate_limit("tickets", "120/60", per="ip")
+    """
+    def decorator(f):
+        @wraps(f)
+        def decorated_function(*args, **kwargs):
+            spec = _limit_spec(name, default)
+            if not spec:
+                return f(*args, **kwargs)
+            limit, window = spec
+            identifier = rate_limit_key(name, per, session.get('user_id'), request.remote_addr)
+            result = rate_limiter.hit(identifier, limit, window)
+            if not result.allowed:
+                resp = jsonify({"error": "rate limit exceeded", "retryAfter": result.headers()["Retry-After"]})
+                resp.status_code = 429
+            else:
+                resp = make_response(f(*args, **kwargs))
+            resp.headers.update(result.headers())
+            return resp
+        return decorated_function
+    return decorator
@@ -0,0 +1,58 @@
+#!/usr/bin/env bash
+# Local three-member replica set for testing read routing (secondary reads,
+# max staleness, causal read-your-writes).
+#
+#   scripts/local_replica_set.sh start    # mongod on 27017-27019, rs0
+#   scripts/local_replica_set.sh stop
+#   scripts/local_replica_set.sh lag 30   # delay one secondary by 30s
+#
+# Then run the app with
+#   MONGO_URI="mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs0"
+# Needs mongod and mongosh on PATH. Data lives in ${RS_DIR:-/tmp/ticket-rs}.
+set -euo pipefail
+
+RS_DIR="${RS_DIR:-/tmp/ticket-rs}"
+PORTS=(27017 27018 27019)
+
+start() {
+    for port in "${PORTS[@]}"; do
+        mkdir -p "$RS_DIR/$port"
+        mongod --replSet rs0 --port "$port" --bind_ip localhost \
+            --dbpath "$RS_DIR/$port" --logpath "$RS_DIR/$port.log" --fork >/dev/null
+    done
+    mongosh --quiet --port "${PORTS[0]}" --eval '
+        try { rs.status() } catch (e) {
+            rs.initiate({_id: "rs0", members: [
+                {_id: 0, host: "localhost:27017", priority: 2},
+                {_id: 1, host: "localhost:27018"},
+                {_id: 2, host: "localhost:27019"}
+            ]})
+        }
+        while (!db.hello().isWritablePrimary) { sleep(200) }
+        print("rs0 ready")'
+    echo "MONGO_URI=\"mongodb://localhost:27017,localhost:27018,localhost:27019/?replicaSet=rs0\""
+}
+
+stop() {
+    for port in "${PORTS[@]}"; do
+        mongosh --quiet --port "$port" --eval 'db.getSiblingDB("admin").shutdownServer({force: true})' >/dev/null 2>&1 || true
+    done
+}
+
+# Hidden delayed secondary is not eligible for reads, so lag is simulated by
+# pausing replication on the last member instead
+lag() {
+    local seconds="${1:-30}"
+    mongosh --quiet --port "${PORTS[2]}" --eval "db.adminCommand({fsync: 1, lock: true})" >/dev/null
+    echo "localhost:${PORTS[2]} paused for ${seconds}s"
+    sleep "$seconds"
+    mongosh --quiet --port "${PORTS[2]}" --eval "db.adminCommand({fsyncUnlock: 1})" >/dev/null
+    echo "localhost:${PORTS[2]} resumed"
+}
+
+case "${1:-}" in
+    start) start ;;
+    stop) stop ;;
+    lag) lag "${2:-30}" ;;
+    *) echo "usage: $0 start|stop|lag [seconds]" >&2; exit 1 ;;
+esac
@@ -0,0 +1,159 @@
+import json
+import zlib
+from datetime import datetime, date
+from typing import Any
+from bson import ObjectId
+from bson.int64 import Int64
+from flask.json.provider import DefaultJSONProvider
+from metrics import timed
+
+# Optional fast paths - plain json is used when these are not installed
+try:
+    import orjson
+except ImportError:
+    orjson = None
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+# Cache value codec
+#
+# Frames are self-describing, so values written with any codec setting can be
+# read back by any other (and by workers running older code, for plain JSON):
+#   JSON text             - no prefix (starts with '{', '[', '"', digit, ...)
+#   b"\x00m" + msgpack    - binary msgpack
+#   b"\x00z" + zlib(...)  - compressed frame wrapping one of the above
+_MSGPACK = b"\x00m"
+_ZLIB = b"\x00z"
+
+# msgpack extension type codes
+_EXT_OBJECTID = 1
+_EXT_DATETIME = 2
+_EXT_INT64 = 3
+
+def _json_default(o):
+    if isinstance(o, ObjectId):
+        return {"$oid": str(o)}
+    if isinstance(o, datetime):
+        return {"$date": o.isoformat()}
+    if isinstance(o, date):
+        return o.isoformat()
+    return str(o)
+
+def _json_hook(d):
+    if len(d) == 1:
+        if "$oid" in d:
+            return ObjectId(d["$oid"])
+        if "$date" in d:
+            return datetime.fromisoformat(d["$date"])
+    return d
+
+def _msgpack_default(o):
+    if isinstance(o, ObjectId):
+        return msgpack.ExtType(_EXT_OBJECTID, o.binary)
+    if isinstance(o, datetime):
+        return msgpack.ExtType(_EXT_DATETIME, o.isoformat().encode())
+    if isinstance(o, Int64):
+        return msgpack.ExtType(_EXT_INT64, int(o).to_bytes(8, "big", signed=True))
+    if isinstance(o, tuple):
+        return list(o)
+    if isinstance(o, int):  # other int subclasses (bool is handled natively)
+        return int(o)
+    if isinstance(o, dict):
+        return dict(o)
+    return str(o)
+
+def _msgpack_ext_hook(code, data):
+    if code == _EXT_OBJECTID:
+        return ObjectId(data)
+    if code == _EXT_DATETIME:
+        return datetime.fromisoformat(data.decode())
+    if code == _EXT_INT64:
+        return Int64(int.from_bytes(data, "big", signed=True))
+    return msgpack.ExtType(code, data)
+
+class CacheCodec:
+    """Encodes cache values to bytes and back.
+
+    fmt is "json" (default) or "msgpack"; values bigger than compress_min
+    bytes are zlib-compressed (0 disables compression). ObjectId and datetime
+    round-trip in both formats; Int64 round-trips as Int64 with msgpack and
+    as a plain int with JSON.
+    """
+
+    def __init__(self, fmt: str = "json", compress_min: int = 0, level: int = 1):
+        if fmt == "msgpack" and msgpack is None:
+            print("msgpack is not installed, cache codec falls back to JSON")
+            fmt = "json"
+        self.fmt = fmt
+        self.compress_min = compress_min
+        self.level = level
+
+    def dumps(self, value: Any) -> bytes:
+        with timed("serialize"):
+            return self._dumps(value)
+
+    def _dumps(self, value: Any) -> bytes:
+        if self.fmt == "msgpack":
+            raw = _MSGPACK + msgpack.packb(value, default=_msgpack_default, strict_types=True, use_bin_type=True)
+        else:
+            raw = json.dumps(value, default=_json_default, separators=(",", ":")).encode()
+        if self.compress_min and len(raw) > self.compress_min:
+            raw = _ZLIB + zlib.compress(raw, self.level)
+        return raw
+
+    def loads(self, raw) -> Any:
+        with timed("serialize"):
+            return self._loads(raw)
+
+    def _loads(self, raw) -> Any:
+        if isinstance(raw, str):
+            raw = raw.encode()
+        if raw.startswith(_ZLIB):
+            raw = zlib.decompress(raw[len(_ZLIB):])
+        if raw.startswith(_MSGPACK):
+            if msgpack is None:
+                raise ValueError("msgpack frame but msgpack is not installed")
+            return msgpack.unpackb(raw[len(_MSGPACK):], ext_hook=_msgpack_ext_hook, raw=False, strict_map_key=False)
+        return json.loads(raw, object_hook=_json_hook)
+
+# Flask JSON provider
+#
+# Same output as Flask's default provider (sorted keys, HTTP dates for
+# datetimes) but encoded with orjson when available, and ObjectId is
+# understood natively.
+
+def _response_default(o):
+    if isinstance(o, ObjectId):
+        return str(o)
+    return DefaultJSONProvider.default(o)  # dates as HTTP dates, Decimal, UUID, ...
+
+class FastJSONProvider(DefaultJSONProvider):
+    default = staticmethod(_response_default)
+
+    def _orjson_dumps(self, obj, pretty: bool = False) -> bytes:
+        opts = orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_NON_STR_KEYS
+        if self.sort_keys:
+            opts |= orjson.OPT_SORT_KEYS
+        if pretty:
+            opts |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=_response_default, option=opts)
+
+    def dumps(self, obj: Any, **kwargs: Any) -> str:
+        if orjson is None or set(kwargs) - {"indent", "separators", "sort_keys", "default"}:
+            return super().dumps(obj, **kwargs)
+        return self._orjson_dumps(obj, pretty=bool(kwargs.get("indent"))).decode()
+
+    def loads(self, s, **kwargs: Any) -> Any:
+        if orjson is None or kwargs:
+            return super().loads(s, **kwargs)
+        return orjson.loads(s)
+
+    def response(self, *args: Any, **kwargs: Any):
+        with timed("serialize"):
+            if orjson is None:
+                return super().response(*args, **kwargs)
+            obj = self._prepare_response_obj(args, kwargs)
+            pretty = self.compact is False or (self.compact is None and self._app.debug)
+            return self._app.response_class(self._orjson_dumps(obj, pretty) + b"\n", mimetype=self.mimetype)
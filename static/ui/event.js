@@ -115,7 +115,7 @@ document.addEventListener('DOMContentLoaded', () => {
       } else {
         infoEl.style.display = 'none';
       }
-  await loadTickets();
+  if (!startLiveAvailability()) await loadTickets();
     } catch (err) {
       console.error('loadEvent error', err);
       titleEl.textContent = 'Error loading event';
@@ -124,7 +124,68 @@ document.addEventListener('DOMContentLoaded', () => {
     }
   }
 
+  // Live availability: rows from /events/<id>/availability/stream (same shape
+  // as GET /tickets) kept up to date by server-sent deltas, so the page never
+  // re-fetches /tickets. Filters are applied locally while the stream is open.
+  const liveRows = new Map();
+  let liveSource = null;
+  let renderQueued = false;
+
+  function matchesFilters(t) {
+    const seat = (filterSeat?.value || '').trim().toUpperCase();
+    const type = String(t.type || '').toUpperCase();
+    if (seat && seat !== 'ALL') {
+      if (['GA', 'GENERAL', 'GENERAL ADMISSION'].includes(seat)) {
+        if (type !== 'GA') return false;
+      } else if (!String(t.seat || '').toUpperCase().startsWith(seat) && !type.startsWith(seat)) {
+        return false;
+      }
+    }
+    const min = parseFloat(filterMin?.value);
+    const max = parseFloat(filterMax?.value);
+    if (!isNaN(min) && Number(t.price) < min) return false;
+    if (!isNaN(max) && Number(t.price) > max) return false;
+    return true;
+  }
+
+  function renderLive() {
+    if (renderQueued) return;
+    renderQueued = true;
+    requestAnimationFrame(() => {
+      renderQueued = false;
+      renderTickets(Array.from(liveRows.values()).filter(matchesFilters));
+    });
+  }
+
+  function startLiveAvailability() {
+    if (!window.EventSource) return false;
+    ticketsEl.innerHTML = 'Loading tickets...';
+    liveSource = new EventSource('/events/' + encodeURIComponent(eventId) + '/availability/stream');
+    liveSource.addEventListener('snapshot', e => {
+      const j = JSON.parse(e.data);
+      liveRows.clear();
+      (j.rows || []).forEach(t => liveRows.set(String(t._id), t));
+      renderLive();
+    });
+    liveSource.addEventListener('delta', e => {
+      const j = JSON.parse(e.data);
+      (j.removed || []).forEach(id => liveRows.delete(String(id)));
+      (j.upserted || []).forEach(t => liveRows.set(String(t._id), t));
+      renderLive();
+    });
+    liveSource.onerror = () => {
+      // EventSource reconnects by itself (and gets a fresh snapshot); only a
+      // refused stream (e.g. 429) closes it - fall back to plain requests
+      if (liveSource && liveSource.readyState === EventSource.CLOSED) {
+        liveSource = null;
+        loadTickets();
+      }
+    };
+    return true;
+  }
+
   async function loadTickets() {
+    if (liveSource) { renderLive(); return; }
     try {
       ticketsEl.innerHTML = 'Loading tickets...';
       if (dropdownEl) dropdownEl.innerHTML = '';
@@ -137,8 +198,20 @@ document.addEventListener('DOMContentLoaded', () => {
       const r = await fetch('/tickets?' + query.toString());
       if (!r.ok) { ticketsEl.textContent = 'Failed to load tickets'; return; }
       const j = await r.json();
-      let data = j.data || [];
+      renderTickets(j.data || []);
+    } catch (err) {
+      console.error('loadTickets error', err);
+      ticketsEl.textContent = 'Error loading tickets (see console)';
+    }
+  }
+
+  function renderTickets(data) {
+    try {
+      // Keep the visitor's selection across live updates
+      const selected = new Set(Array.from(ticketsEl.querySelectorAll('input[name="ticket"]:checked')).map(i => i.value));
+      const gaQtyPrev = document.getElementById('gaQty')?.value;
       ticketsEl.innerHTML = '';
+      if (dropdownEl) dropdownEl.innerHTML = '';
 
       if (!data.length) {
         ticketsEl.innerHTML = '<div class="meta">No tickets available</div>';
@@ -213,16 +286,19 @@ document.addEventListener('DOMContentLoaded', () => {
       });
 
       ticketsEl.querySelectorAll('input[name="ticket"]').forEach(chk => {
+        if (selected.has(chk.value)) chk.checked = true;
         chk.addEventListener('change', updateTotal);
       });
-      if (dropdownEl) dropdownEl.addEventListener('change', updateTotal);
+      const gaQty = document.getElementById('gaQty');
+      if (gaQty && gaQtyPrev) gaQty.value = Math.max(1, Math.min(Number(gaQtyPrev) || 1, Number(gaQty.max) || 1));
 
       updateTotal();
     } catch (err) {
-      console.error('loadTickets error', err);
+      console.error('renderTickets error', err);
       ticketsEl.textContent = 'Error loading tickets (see console)';
     }
   }
+  if (dropdownEl) dropdownEl.addEventListener('change', updateTotal);
 
   if (applyBtn) {
     applyBtn.addEventListener('click', ev => {
@@ -291,7 +367,7 @@ document.addEventListener('DOMContentLoaded', () => {
       alert(`${failCount} ticket(s) could not be added (already reserved or sold)`);
     }
     
-    // Reload tickets to refresh availability
+    // Refresh availability (with a live stream the held seats arrive as deltas)
     await loadTickets();
   });
 